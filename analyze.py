@@ -1,11 +1,65 @@
 import ast
 import os
+import sys
 import io
+import re
+import math
+import glob
 import shutil
+import argparse
+import json
 import tokenize
+from bisect import bisect_left, bisect_right
+from collections import deque
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import AnalysisCache, content_hash, config_hash
+from timing import NULL_TIMER, PhaseTimer, profile_call, write_timings
+from watch import make_watcher
+
+DEFAULT_THRESHOLDS = {
+    "branch_count": 4,
+    "depth": 2,
+    "lines": 50,
+}
+# DEFAULT_THRESHOLDS = {"branch_count": 0, "depth": 0, "lines": 0}
+
+METRIC_NAMES = (
+    "branch_count",
+    "depth",
+    "lines",
+    "cyclomatic",
+    "cognitive",
+    "halstead_volume",
+    "params",
+)
+
+# bump whenever the shape of cached results changes
+CACHE_FORMAT = 6
+
+HALSTEAD_OPERATORS = (
+    ast.operator,
+    ast.unaryop,
+    ast.cmpop,
+    ast.boolop,
+    ast.Assign,
+    ast.AugAssign,
+    ast.AnnAssign,
+    ast.Call,
+    ast.Attribute,
+    ast.Subscript,
+    ast.Return,
+)
 
 class ConditionCounter(ast.NodeVisitor):
+    # Besides the branch count and nesting depth this keeps the counters for
+    # cyclomatic complexity, cognitive complexity and Halstead volume, all
+    # updated during the same walk.
     def __init__(self):
+        self.reset()
+
+    def reset(self):
         self.conds = {
             "if": 0,
             "for": 0,
@@ -14,6 +68,58 @@ class ConditionCounter(ast.NodeVisitor):
         }
         self.depth = 0
         self.max_depth = 0
+        self.decisions = 0
+        self.cognitive = 0
+        self.nesting = 0
+        self.operators = {}
+        self.operands = {}
+        self._elifs = set()
+
+    _state = (
+        "conds",
+        "depth",
+        "max_depth",
+        "decisions",
+        "cognitive",
+        "nesting",
+        "operators",
+        "operands",
+        "_elifs",
+    )
+
+    def save(self):
+        return tuple(getattr(self, key) for key in self._state)
+
+    def restore(self, state):
+        for key, value in zip(self._state, state):
+            setattr(self, key, value)
+
+    @property
+    def cyclomatic(self):
+        return self.decisions + 1
+
+    @property
+    def halstead_volume(self):
+        vocabulary = len(self.operators) + len(self.operands)
+        if vocabulary < 2:
+            return 0.0
+        length = sum(self.operators.values()) + sum(self.operands.values())
+        return length * math.log2(vocabulary)
+
+    def visit(self, node):
+        if isinstance(node, HALSTEAD_OPERATORS):
+            key = type(node).__name__
+            self.operators[key] = self.operators.get(key, 0) + 1
+
+        if isinstance(node, ast.Name):
+            self.operands[node.id] = self.operands.get(node.id, 0) + 1
+        elif isinstance(node, ast.Constant):
+            key = repr(node.value)
+            self.operands[key] = self.operands.get(key, 0) + 1
+        elif isinstance(node, ast.Attribute):
+            self.operands[node.attr] = self.operands.get(node.attr, 0) + 1
+
+        return super().visit(node)
 
     def _enter(self):
         self.depth += 1
@@ -22,34 +128,85 @@ class ConditionCounter(ast.NodeVisitor):
     def _exit(self):
         self.depth -= 1
 
+    def _nested(self, node):
+        self.nesting += 1
+        self.generic_visit(node)
+        self.nesting -= 1
+
     def visit_If(self, node):
         self.conds["if"] += self._count_expr(node.test)
+        self.decisions += 1
+
+        if node in self._elifs:
+            self.cognitive += 1
+        else:
+            self.cognitive += 1 + self.nesting
 
         if node.orelse and not isinstance(node.orelse[0], ast.If):
             self.conds["if"] += 1
 
+        if len(node.orelse) == 1 and isinstance(node.orelse[0], ast.If):
+            self._elifs.add(node.orelse[0])
+        elif node.orelse:
+            self.cognitive += 1
+
         self._enter()
-        self.generic_visit(node)
+        if node in self._elifs:
+            self.generic_visit(node)
+        else:
+            self._nested(node)
         self._exit()
 
     def visit_For(self, node):
         self.conds["for"] += 1
+        self.decisions += 1
+        self.cognitive += 1 + self.nesting
         self._enter()
-        self.generic_visit(node)
+        self._nested(node)
         self._exit()
 
+    def visit_AsyncFor(self, node):
+        self.visit_For(node)
+
     def visit_While(self, node):
         self.conds["while"] += self._count_expr(node.test)
+        self.decisions += 1
+        self.cognitive += 1 + self.nesting
         self._enter()
-        self.generic_visit(node)
+        self._nested(node)
         self._exit()
 
     def visit_Match(self, node):
         self.conds["match"] += len(node.cases)
+        self.decisions += len(node.cases)
+        self.cognitive += 1 + self.nesting
         self._enter()
-        self.generic_visit(node)
+        self._nested(node)
         self._exit()
 
+    def visit_ExceptHandler(self, node):
+        self.decisions += 1
+        self.cognitive += 1 + self.nesting
+        self._nested(node)
+
+    def visit_IfExp(self, node):
+        self.decisions += 1
+        self.cognitive += 1 + self.nesting
+        self._nested(node)
+
+    def visit_BoolOp(self, node):
+        self.decisions += len(node.values) - 1
+        self.cognitive += 1
+        self.generic_visit(node)
+
+    def visit_comprehension(self, node):
+        self.decisions += 1 + len(node.ifs)
+        self.cognitive += 1
+        self.generic_visit(node)
+
+    def visit_Lambda(self, node):
+        self._nested(node)
+
     def _count_expr(self, expr):
         if isinstance(expr, ast.BoolOp):
             return sum(self._count_expr(v) for v in expr.values)
@@ -65,6 +222,154 @@ class ConditionCounter(ast.NodeVisitor):
 
         return 1
 
+def param_names(node, parent):
+    args = node.args
+    params = [*args.posonlyargs, *args.args]
+    if (
+        isinstance(parent, ast.ClassDef)
+        and params
+        and params[0].arg in ("self", "cls")
+    ):
+        params = params[1:]
+
+    names = [arg.arg for arg in params]
+    if args.vararg is not None:
+        names.append(args.vararg.arg)
+    names.extend(arg.arg for arg in args.kwonlyargs)
+    if args.kwarg is not None:
+        names.append(args.kwarg.arg)
+    return names
+
+def count_params(node, parent):
+    return len(param_names(node, parent))
+
+# Section markers of the Google, NumPy and Sphinx styles, plus the headings
+# the api.py prompt asks the model to write. Matched on the lower-cased text.
+DOCSTRING_SECTIONS = {
+    "args": ("args:", "arguments:", "parameters:", "parameters\n", "keyword arguments:",
+             ":param", "引数:"),
+    "returns": ("returns:", "returns\n", "return:", ":return", ":rtype", "戻り値:"),
+    "yields": ("yields:", "yields\n", ":yield", "戻り値:"),
+    "raises": ("raises:", "raises\n", ":raise", "送出する例外:"),
+}
+
+def docstring_sections(doc):
+    doc = doc.lower()
+    return {
+        section for section, markers in DOCSTRING_SECTIONS.items()
+        if any(marker in doc for marker in markers)
+    }
+
+def is_documented(node, parent, returns_value=False, yields=False, raises=False):
+    # True when the docstring already covers the signature: every parameter
+    # is mentioned under an argument section, and returned values, yielded
+    # values and raised exceptions have their own sections.
+    doc = ast.get_docstring(node)
+    if not doc:
+        return False
+
+    sections = docstring_sections(doc)
+    params = param_names(node, parent)
+
+    if params:
+        if "args" not in sections:
+            return False
+        words = set(re.findall(r"\w+", doc))
+        if any(name not in words for name in params):
+            return False
+
+    if returns_value and "returns" not in sections:
+        return False
+    if yields and "yields" not in sections:
+        return False
+    if raises and "raises" not in sections:
+        return False
+
+    return True
+
+def qualified_name(stack, node):
+    parts = []
+    for outer in stack:
+        parts.append(outer.name)
+        if isinstance(outer, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            parts.append("<locals>")
+    parts.append(node.name)
+    return ".".join(parts)
+
+class FunctionMetricsCollector(ConditionCounter):
+    # Collects every function together with its own branch count and max depth
+    # in a single walk; nested functions are scored on their own frame.
+    def __init__(self):
+        super().__init__()
+        self.functions = []
+        self.stack = []
+        self._frames = []
+
+    def visit_ClassDef(self, node):
+        self.stack.append(node)
+        self.generic_visit(node)
+        self.stack.pop()
+
+    def visit_FunctionDef(self, node):
+        parent = self.stack[-1] if self.stack else None
+        record = {
+            "node": node,
+            "parent": parent,
+            "qualname": qualified_name(self.stack, node),
+            "nested": [],
+            "returns_value": False,
+            "yields": False,
+            "raises": False,
+        }
+        self.functions.append(record)
+
+        if self._frames:
+            self._frames[-1]["nested"].append(node)
+
+        saved = self.save()
+        self.reset()
+
+        self.stack.append(node)
+        self._frames.append(record)
+        self.generic_visit(node)
+        self._frames.pop()
+        self.stack.pop()
+
+        record["branch_count"] = sum(self.conds.values())
+        record["depth"] = self.max_depth
+        record["cyclomatic"] = self.cyclomatic
+        record["cognitive"] = self.cognitive
+        record["halstead_volume"] = round(self.halstead_volume, 1)
+        record["params"] = count_params(node, parent)
+        record["documented"] = is_documented(
+            node, parent, record["returns_value"], record["yields"], record["raises"]
+        )
+        self.restore(saved)
+
+    def visit_AsyncFunctionDef(self, node):
+        self.visit_FunctionDef(node)
+
+    def visit_Return(self, node):
+        value = node.value
+        if self._frames and value is not None and not (
+            isinstance(value, ast.Constant) and value.value is None
+        ):
+            self._frames[-1]["returns_value"] = True
+        self.generic_visit(node)
+
+    def visit_Yield(self, node):
+        if self._frames:
+            self._frames[-1]["yields"] = True
+        self.generic_visit(node)
+
+    def visit_YieldFrom(self, node):
+        self.visit_Yield(node)
+
+    def visit_Raise(self, node):
+        if self._frames and node.exc is not None:
+            self._frames[-1]["raises"] = True
+        self.generic_visit(node)
+
 class FunctionCollector(ast.NodeVisitor):
     def __init__(self):
         self.functions = []
@@ -77,7 +382,7 @@ class FunctionCollector(ast.NodeVisitor):
 
     def visit_FunctionDef(self, node):
         parent = self.stack[-1] if self.stack else None
-        self.functions.append((node, parent))
+        self.functions.append((node, parent, qualified_name(self.stack, node)))
 
         self.stack.append(node)
         self.generic_visit(node)
@@ -85,7 +390,7 @@ class FunctionCollector(ast.NodeVisitor):
 
     def visit_AsyncFunctionDef(self, node):
         parent = self.stack[-1] if self.stack else None
-        self.functions.append((node, parent))
+        self.functions.append((node, parent, qualified_name(self.stack, node)))
 
         self.stack.append(node)
         self.generic_visit(node)
@@ -113,25 +418,144 @@ class RemoveNestedFunctions(ast.NodeTransformer):
     def visit_AsyncFunctionDef(self, node):
         return self.visit_FunctionDef(node)
 
+class RemoveDocstrings(ast.NodeTransformer):
+    def _strip(self, node):
+        self.generic_visit(node)
+        if ast.get_docstring(node, clean=False) is not None:
+            node.body = node.body[1:]
+        return node
+
+    visit_FunctionDef = _strip
+    visit_AsyncFunctionDef = _strip
+    visit_ClassDef = _strip
+
+def normalized_hash(func_src):
+    # Hash of the function's AST without docstrings, comments, formatting,
+    # positions or its own name, so copies of one function in different
+    # files hash the same.
+    if func_src[:1] in (" ", "\t"):
+        # an indented method still parses as the body of a dummy block
+        fn = ast.parse("if 1:\n" + func_src).body[0].body[0]
+    else:
+        fn = ast.parse(func_src).body[0]
+
+    fn = RemoveDocstrings().visit(fn)
+    fn.name = ""
+    return content_hash(ast.dump(fn))
+
 def remove_inner_functions(fn):
     fn.body = [
         n for n in fn.body
         if not isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))
     ]
 
+class FunctionSpan:
+    # Where a function sits in the original source. Only offsets are kept;
+    # the text is sliced out of the file when somebody asks for it.
+    __slots__ = ("source", "lineno", "end_lineno", "start", "end")
+
+    def __init__(self, source, lineno, end_lineno, start, end):
+        self.source = source
+        self.lineno = lineno
+        self.end_lineno = end_lineno
+        self.start = start
+        self.end = end
+
+    @property
+    def src(self):
+        return self.source[self.start:self.end]
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __str__(self):
+        return self.src
+
+    def __repr__(self):
+        return f"FunctionSpan(lineno={self.lineno}, end_lineno={self.end_lineno})"
+
+class FunctionMetrics:
+    __slots__ = (
+        "name",
+        "qualname",
+        "line",
+        "span",
+        *METRIC_NAMES,
+        "documented",
+        "_content_hash",
+        "_normalized_hash",
+    )
+
+    def __init__(self, name, qualname, line, span, metrics, function_hash=None,
+                 documented=False):
+        self.name = name
+        self.qualname = qualname
+        self.line = line
+        self.span = span
+        for key in METRIC_NAMES:
+            setattr(self, key, metrics.get(key, 0))
+        self.documented = documented
+        self._content_hash = function_hash
+        self._normalized_hash = None
+
+    def metrics(self):
+        return {key: getattr(self, key) for key in METRIC_NAMES}
+
+    @property
+    def content_hash(self):
+        if self._content_hash is None:
+            self._content_hash = content_hash(self.span.src)
+        return self._content_hash
+
+    @property
+    def normalized_hash(self):
+        # re-parses the span, so only worth asking for functions that are
+        # about to be sent to the model
+        if self._normalized_hash is None:
+            self._normalized_hash = normalized_hash(self.span.src)
+        return self._normalized_hash
+
+    def __repr__(self):
+        return (
+            f"FunctionMetrics({self.qualname!r}, line={self.line}, "
+            f"branch_count={self.branch_count}, depth={self.depth}, lines={self.lines}, "
+            f"cyclomatic={self.cyclomatic}, cognitive={self.cognitive}, "
+            f"halstead_volume={self.halstead_volume}, params={self.params})"
+        )
+
+def line_offsets(src):
+    offsets = [0]
+    pos = src.find("\n")
+    while pos != -1:
+        offsets.append(pos + 1)
+        pos = src.find("\n", pos + 1)
+    return offsets
+
+def function_start(fn):
+    if fn.decorator_list:
+        return min(fn.lineno, fn.decorator_list[0].lineno)
+    return fn.lineno
+
+def function_span(src, offsets, fn):
+    return span_from_lines(src, offsets, function_start(fn), fn.end_lineno)
+
+def span_from_lines(src, offsets, lineno, end_lineno):
+    start = offsets[lineno - 1]
+    end = offsets[end_lineno] if end_lineno < len(offsets) else len(src)
+    return FunctionSpan(src, lineno, end_lineno, start, end)
+
 def split_functions(src):
     tree = ast.parse(src)
 
     collector = FunctionCollector()
     collector.visit(tree)
 
+    offsets = line_offsets(src)
     functions = {}
 
-    for fn, parent in collector.functions:
-        remove_inner_functions(fn)
-        name = fn.name
-        functions[name] = {
-            "src": ast.unparse(fn),
+    for fn, parent, qualname in collector.functions:
+        functions[qualname] = {
+            "span": function_span(src, offsets, fn),
             "line": fn.lineno
         }
 
@@ -149,76 +573,681 @@ def split_functions(src):
 
     return functions
 
-def count_code_lines_from_src(src):
+NON_CODE_TOKENS = frozenset((
+    tokenize.COMMENT,
+    tokenize.NL,
+    tokenize.NEWLINE,
+    tokenize.ENCODING,
+    tokenize.ENDMARKER,
+    tokenize.STRING,
+    tokenize.INDENT,
+    tokenize.DEDENT,
+))
+
+def iter_code_lines(src):
+    # every line that carries a code token, ascending and without repeats
     reader = io.StringIO(src)
 
-    code_lines = set()
+    last = 0
     tokens = tokenize.generate_tokens(reader.readline)
     for tok in tokens:
-        if tok.type in (
-            tokenize.COMMENT,
-            tokenize.NL,
-            tokenize.NEWLINE,
-            tokenize.ENCODING,
-            tokenize.ENDMARKER,
-            tokenize.STRING,
-            tokenize.INDENT,
-            tokenize.DEDENT,
-        ):
+        if tok.type in NON_CODE_TOKENS:
+            continue
+
+        lineno = tok.start[0]
+        if lineno != last:
+            yield lineno
+            last = lineno
+
+def count_code_lines_from_src(src):
+    return sum(1 for _ in iter_code_lines(src))
+
+def count_lines_between(code_lines, first, last):
+    # code_lines is sorted, so a line range is two bisects
+    return bisect_right(code_lines, last) - bisect_left(code_lines, first)
+
+def record_metrics(record, code_lines):
+    metrics = {key: record[key] for key in METRIC_NAMES if key in record}
+    metrics["lines"] = count_function_code_lines(record, code_lines)
+    return metrics
+
+def count_function_code_lines(record, code_lines):
+    # nested functions are scored on their own, so their lines are taken out
+    fn = record["node"]
+    lines = count_lines_between(code_lines, function_start(fn), fn.end_lineno)
+    for inner in record["nested"]:
+        lines -= count_lines_between(code_lines, function_start(inner), inner.end_lineno)
+    return lines
+
+def iter_function_metrics(src, timer=NULL_TIMER):
+    # Scores the module one top-level statement at a time and only tokenizes
+    # as far as the statement just walked, so the first functions come out
+    # before the rest of the file has been looked at.
+    with timer.phase("parse"):
+        tree = ast.parse(src)
+        offsets = line_offsets(src)
+
+    lines = iter_code_lines(src)
+    code_lines = []
+    scanned = 0
+
+    collector = FunctionMetricsCollector()
+    for stmt in tree.body:
+        with timer.phase("walk"):
+            collector.functions = []
+            collector.visit(stmt)
+        if not collector.functions:
             continue
 
-        code_lines.add(tok.start[0])
+        with timer.phase("tokenize"):
+            # tokens arrive in order, so code_lines stays sorted
+            while scanned < stmt.end_lineno:
+                lineno = next(lines, None)
+                if lineno is None:
+                    break
+                code_lines.append(lineno)
+                scanned = lineno
+
+        with timer.phase("records"):
+            scored = [
+                FunctionMetrics(
+                    record["node"].name,
+                    record["qualname"],
+                    record["node"].lineno,
+                    function_span(src, offsets, record["node"]),
+                    record_metrics(record, code_lines),
+                    documented=record["documented"],
+                )
+                for record in collector.functions
+            ]
+        timer.count("functions", len(scored))
+
+        yield from scored
 
-    return len(code_lines)
+def collect_function_metrics(src):
+    return list(iter_function_metrics(src))
 
-def main(src):
+def score_function(src, offsets, fn, parent, qualname, function_hash=None):
+    # Scores a single function from its own text, for callers that already
+    # know the metrics of the rest of the file.
+    collector = FunctionMetricsCollector()
+    if parent is not None:
+        collector.stack.append(parent)
+    collector.visit(fn)
+    record = collector.functions[0]
+
+    span = function_span(src, offsets, fn)
+    code_lines = [
+        span.lineno + lineno - 1
+        for lineno in iter_code_lines(span.src)
+    ]
+    return FunctionMetrics(
+        fn.name,
+        qualname,
+        fn.lineno,
+        span,
+        record_metrics(record, code_lines),
+        function_hash,
+        record["documented"],
+    )
+
+def is_flagged(metrics, thresholds=None):
+    # any metric named in thresholds can flag a function; {} means every
+    # criterion was turned off, not the defaults
+    if thresholds is None:
+        thresholds = DEFAULT_THRESHOLDS
+    return any(
+        getattr(metrics, key) > limit
+        for key, limit in thresholds.items()
+    )
+
+def needs_docstring(metrics, thresholds=None, regenerate=False):
+    # functions whose docstring already covers the signature are skipped
+    # unless regenerate is set
+    if metrics.documented and not regenerate:
+        return False
+    return is_flagged(metrics, thresholds)
+
+def iter_flagged_functions(src, thresholds=None, regenerate=False,
+                           timer=NULL_TIMER):
+    for metrics in iter_function_metrics(src, timer):
+        if needs_docstring(metrics, thresholds, regenerate):
+            timer.count("flagged")
+            yield metrics
+
+def report_key(ng, metrics):
+    # a function defined twice under if/else shares its qualname with the
+    # other definition; the later one gets its line appended
+    if metrics.qualname in ng:
+        return f"{metrics.qualname}@{metrics.line}"
+    return metrics.qualname
+
+def main(src, thresholds=None, regenerate=False, timer=NULL_TIMER):
     NG_FUNC = {}
 
-    funcs = split_functions(src)
+    for metrics in iter_flagged_functions(src, thresholds, regenerate, timer):
+        NG_FUNC[report_key(NG_FUNC, metrics)] = metrics
 
-    for name, info in funcs.items():
-        func_src = info["src"]
-        lineno = info["line"]
+    return NG_FUNC
 
-        line = count_code_lines_from_src(func_src)
+def cached_main(src, path, cache, thresholds=None, regenerate=False,
+                timer=NULL_TIMER):
+    if thresholds is None:
+        thresholds = DEFAULT_THRESHOLDS
+    with timer.phase("hash"):
+        file_hash = content_hash(src)
+        thresholds_hash = config_hash({
+            "format": CACHE_FORMAT,
+            "thresholds": thresholds,
+            "regenerate": regenerate,
+        })
+        offsets = line_offsets(src)
 
-        tree = ast.parse(func_src)
-        counter = ConditionCounter()
-        counter.visit(tree)
+    with timer.phase("cache"):
+        cached = cache.get_file(path, file_hash, thresholds_hash)
+    if cached is not None:
+        timer.count("file_cache_hits")
+        NG_FUNC = {}
+        for name, qualname, line, lineno, end_lineno, metrics, documented in cached:
+            span = span_from_lines(src, offsets, lineno, end_lineno)
+            metrics = FunctionMetrics(
+                name, qualname, line, span, metrics, documented=documented
+            )
+            NG_FUNC[report_key(NG_FUNC, metrics)] = metrics
+        return NG_FUNC
 
-        branch_count = sum(counter.conds.values())
-        depth = counter.max_depth
+    with timer.phase("parse"):
+        tree = ast.parse(src)
+    with timer.phase("walk"):
+        collector = FunctionCollector()
+        collector.visit(tree)
 
-        branch_count_threshhold = 4
-        depth_threshhold = 2
-        line_threshhold = 50
+    NG_FUNC = {}
+    for fn, parent, qualname in collector.functions:
+        span = function_span(src, offsets, fn)
+        with timer.phase("hash"):
+            function_hash = content_hash(span.src)
+        # self/cls only drop out of the parameters of methods, so the same
+        # text scores differently inside and outside a class
+        kind = "method" if isinstance(parent, ast.ClassDef) else "function"
+        function_key = f"{function_hash}:{kind}:{CACHE_FORMAT}"
 
-        # branch_count_threshhold = 0
-        # depth_threshhold = 0
-        # line_threshhold = 0
+        with timer.phase("cache"):
+            cached = cache.get_function(function_key)
+        if cached is None:
+            with timer.phase("score"):
+                metrics = score_function(
+                    src, offsets, fn, parent, qualname, function_hash
+                )
+            with timer.phase("cache"):
+                cache.put_function(function_key, {
+                    **metrics.metrics(),
+                    "documented": metrics.documented,
+                })
+        else:
+            timer.count("function_cache_hits")
+            metrics = FunctionMetrics(
+                fn.name, qualname, fn.lineno, span, cached, function_hash,
+                cached["documented"]
+            )
 
-        if (
-            branch_count > branch_count_threshhold
-            or depth > depth_threshhold
-            or line > line_threshhold
-        ):
-            NG_FUNC[name] = {
-                "src": func_src,
-                "line": lineno
-            }
+        if needs_docstring(metrics, thresholds, regenerate):
+            NG_FUNC[report_key(NG_FUNC, metrics)] = metrics
 
-        # print(f"{name}: {branch_count}: Max Depth={depth}: Lines={line}")
+    timer.count("functions", len(collector.functions))
+    timer.count("flagged", len(NG_FUNC))
 
+    with timer.phase("cache"):
+        cache.put_file(path, file_hash, thresholds_hash, [
+            [
+                metrics.name,
+                metrics.qualname,
+                metrics.line,
+                metrics.span.lineno,
+                metrics.span.end_lineno,
+                metrics.metrics(),
+                metrics.documented,
+            ]
+            for metrics in NG_FUNC.values()
+        ])
     return NG_FUNC
 
+def walk_python_files(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(
+            d for d in dirnames
+            if not d.startswith(".") and d != "__pycache__"
+        )
+        for filename in sorted(filenames):
+            if filename.endswith(".py"):
+                yield os.path.join(dirpath, filename)
+
+def find_python_files(paths):
+    files = []
+    seen = set()
+
+    for path in paths:
+        if any(c in path for c in "*?["):
+            matches = sorted(glob.glob(path, recursive=True))
+        else:
+            matches = [path]
+
+        for match in matches:
+            if os.path.isdir(match):
+                candidates = walk_python_files(match)
+            else:
+                candidates = [match]
+
+            for candidate in candidates:
+                if candidate not in seen:
+                    seen.add(candidate)
+                    files.append(candidate)
+
+    return files
+
+def read_source(path):
+    # tokenize.open honours PEP 263 coding cookies
+    with tokenize.open(path) as f:
+        return f.read()
+
+_caches = {}
+
+def open_cache(cache_path):
+    # one connection per worker process, reused across files
+    if cache_path not in _caches:
+        _caches[cache_path] = AnalysisCache(cache_path)
+    return _caches[cache_path]
+
+def analyze_source(path, src, cache_path=None, thresholds=None, regenerate=False,
+                   timer=NULL_TIMER):
+    if cache_path:
+        cache = open_cache(cache_path)
+        ng = cached_main(
+            src, os.path.abspath(path), cache, thresholds, regenerate, timer
+        )
+        with timer.phase("cache"):
+            cache.commit()
+        return ng
+
+    return main(src, thresholds, regenerate, timer)
+
+TOP_LEVEL_DEF = re.compile(r"(?:async\s+def|def|class)\b")
+
+PARSE_ERRORS = (SyntaxError, ValueError, RecursionError, tokenize.TokenError)
+
+def read_source_lossy(path):
+    # for files whose bytes do not match their declared encoding
+    with open(path, "rb") as f:
+        data = f.read()
+    text = data.decode("utf-8", "replace")
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+def top_level_chunks(lines):
+    # (first, last) line index ranges that each start at a top-level def or
+    # class, together with the decorators right above it
+    starts = [0]
+    for i, line in enumerate(lines):
+        if TOP_LEVEL_DEF.match(line):
+            start = i
+            while start > 0 and lines[start - 1].startswith("@"):
+                start -= 1
+            if start > starts[-1]:
+                starts.append(start)
+    starts.append(len(lines))
+    return list(zip(starts, starts[1:]))
+
+def mask_unparsable(src):
+    # Blanks every chunk that does not parse on its own. Line numbers stay
+    # where they were, so the functions that survive keep their spans.
+    lines = src.split("\n")
+    skipped = []
+    for first, last in top_level_chunks(lines):
+        try:
+            ast.parse("\n".join(lines[first:last]))
+        except PARSE_ERRORS:
+            lines[first:last] = [""] * (last - first)
+            skipped.append([first + 1, last])
+    return "\n".join(lines), skipped
+
+def describe_error(e):
+    return f"{type(e).__name__}: {e}"
+
+def run_tolerant(path, run, timer=NULL_TIMER):
+    # Calls run(src) on the file's text. A file that will not decode or parse
+    # is retried lossily and with its unparsable chunks blanked; returns the
+    # result and a failure record, or None when nothing went wrong.
+    failure = None
+    with timer.phase("read"):
+        try:
+            src = read_source(path)
+        except (SyntaxError, UnicodeDecodeError) as e:
+            failure = {"error": describe_error(e), "recovered": True,
+                       "skipped_lines": []}
+            src = read_source_lossy(path)
+
+    try:
+        return run(src), failure
+    except PARSE_ERRORS as e:
+        # keep whatever top-level functions still parse
+        with timer.phase("recover"):
+            src, skipped = mask_unparsable(src)
+        failure = {"error": describe_error(e), "recovered": True,
+                   "skipped_lines": skipped}
+        return run(src), failure
+
+def analyze_file(path, cache_path=None, thresholds=None, regenerate=False,
+                 timed=False, profile_dir=None):
+    # returns the path, the flagged functions, the phase timings of this file
+    # when timed, and a failure record when the file could not be analyzed
+    # as a whole
+    timer = PhaseTimer() if timed else NULL_TIMER
+
+    def run(src):
+        if profile_dir:
+            ng = profile_call(
+                profile_dir, path, analyze_source,
+                path, src, cache_path, thresholds, regenerate, timer
+            )
+        else:
+            ng = analyze_source(path, src, cache_path, thresholds, regenerate, timer)
+
+        # spans point into the whole file, so only ship the flagged text back
+        return {
+            qualname: {
+                "line": metrics.line,
+                "src": metrics.span.src
+            }
+            for qualname, metrics in ng.items()
+        }
+
+    try:
+        with timer.phase("total"):
+            flagged, failure = run_tolerant(path, run, timer)
+    except Exception as e:
+        # one bad file must not take the rest of the run down with it
+        failure = {"error": describe_error(e), "recovered": False,
+                   "skipped_lines": None}
+        flagged = {}
+
+    return path, flagged, timer.as_dict() if timed else None, failure
+
+# files submitted ahead of the one being waited on, per worker, by
+# map_files(bounded=True)
+FILES_IN_FLIGHT_PER_JOB = 2
+
+def map_files(worker, files, jobs=None, bounded=False):
+    # Results come back in file order. executor.map submits every file at
+    # once and holds finished results behind a slow one, so callers that
+    # stream results out pass bounded to keep only a few files in flight.
+    jobs = jobs or os.cpu_count() or 1
+
+    if jobs == 1 or len(files) < 2:
+        yield from map(worker, files)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        if not bounded:
+            chunksize = max(1, len(files) // (jobs * 4))
+            yield from executor.map(worker, files, chunksize=chunksize)
+            return
+
+        pending = deque()
+        for path in files:
+            if len(pending) >= jobs * FILES_IN_FLIGHT_PER_JOB:
+                yield pending.popleft().result()
+            pending.append(executor.submit(worker, path))
+        while pending:
+            yield pending.popleft().result()
+
+def analyze_paths(paths, jobs=None, cache_path=None, thresholds=None,
+                  regenerate=False, file_timings=None, profile_dir=None,
+                  failures=None):
+    # per-file phase timings are collected into file_timings and files that
+    # failed into failures when they are given
+    files = find_python_files(paths)
+    worker = partial(
+        analyze_file,
+        cache_path=cache_path,
+        thresholds=thresholds,
+        regenerate=regenerate,
+        timed=file_timings is not None,
+        profile_dir=profile_dir
+    )
+
+    report = {}
+    for path, ng, timings, failure in map_files(worker, files, jobs):
+        report[path] = ng
+        if file_timings is not None:
+            file_timings[path] = timings
+        if failure is not None and failures is not None:
+            failures[path] = failure
+
+    return report
+
+def print_report(report):
+    for path, ng in report.items():
+        for name, info in ng.items():
+            print("----")
+            print(f"File: {path}")
+            print(f"NG FUNCTION: {name}")
+            print(f"Defined at line: {info['line']}")
+            print(info["src"])
+
+def flagged_lines(ng):
+    return {qualname: metrics.line for qualname, metrics in ng.items()}
+
+def diff_flagged(path, old, new):
+    # "+" for functions that became flagged, "-" for ones that were cleared
+    lines = []
+    for qualname in sorted(new.keys() - old.keys(), key=new.get):
+        lines.append(f"+ {path}:{new[qualname]}  {qualname}")
+    for qualname in sorted(old.keys() - new.keys(), key=old.get):
+        lines.append(f"- {path}:{old[qualname]}  {qualname}")
+    return lines
+
+def watch(paths, cache_path=None, thresholds=None, regenerate=False,
+          interval=1.0, debounce=0.2, use_inotify=True):
+    # Re-analyzes files as they change and prints what got flagged or
+    # cleared. The function cache means an edit only re-scores the functions
+    # whose source changed; without --cache it lives in memory.
+    cache = open_cache(cache_path or ":memory:")
+    watcher = make_watcher(
+        paths, partial(find_python_files, paths), interval, debounce, use_inotify
+    )
+    state = {}
+
+    def refresh(path):
+        try:
+            src = read_source(path)
+            ng = cached_main(
+                src, os.path.abspath(path), cache, thresholds, regenerate
+            )
+        except (OSError, SyntaxError, UnicodeDecodeError, ValueError) as e:
+            # half-written files are common here; keep the last good result
+            print(f"! {path}: {e}")
+            return []
+
+        new = flagged_lines(ng)
+        lines = diff_flagged(path, state.get(path, {}), new)
+        state[path] = new
+        return lines
+
+    files = find_python_files(paths)
+    for path in files:
+        for line in refresh(path):
+            print(line)
+    cache.commit()
+    flagged = sum(len(ng) for ng in state.values())
+    print(f"watching {len(files)} files, {flagged} functions flagged", flush=True)
+
+    try:
+        for changed, removed in watcher.batches():
+            lines = []
+            for path in sorted(removed):
+                lines.extend(diff_flagged(path, state.pop(path, {}), {}))
+            for path in sorted(changed):
+                lines.extend(refresh(path))
+            cache.commit()
+
+            for line in lines:
+                print(line)
+            sys.stdout.flush()
+    finally:
+        watcher.close()
+
+def print_failures(failures):
+    for path, failure in failures.items():
+        if not failure["recovered"]:
+            detail = "nothing analyzed"
+        elif failure["skipped_lines"]:
+            detail = "skipped lines " + ", ".join(
+                f"{first}-{last}" for first, last in failure["skipped_lines"]
+            )
+        else:
+            detail = "decoded with replacement characters"
+        print(f"FAILED: {path}: {failure['error']} ({detail})", file=sys.stderr)
+
+    if failures:
+        recovered = sum(failure["recovered"] for failure in failures.values())
+        print(
+            f"{len(failures)} files failed, {recovered} partly recovered",
+            file=sys.stderr
+        )
+
+def add_common_arguments(parser):
+    parser.add_argument(
+        "paths", nargs="*", default=["analyze.py"],
+        help="files, directories or glob patterns to analyze"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None,
+        help="number of worker processes (default: number of cores)"
+    )
+    parser.add_argument(
+        "--max-branches", type=int, default=DEFAULT_THRESHOLDS["branch_count"],
+        help="flag functions with more branches than this"
+    )
+    parser.add_argument(
+        "--max-depth", type=int, default=DEFAULT_THRESHOLDS["depth"],
+        help="flag functions nested deeper than this"
+    )
+    parser.add_argument(
+        "--max-lines", type=int, default=DEFAULT_THRESHOLDS["lines"],
+        help="flag functions with more code lines than this"
+    )
+    parser.add_argument(
+        "--max-cyclomatic", type=int, default=None,
+        help="also flag functions above this cyclomatic complexity"
+    )
+    parser.add_argument(
+        "--max-cognitive", type=int, default=None,
+        help="also flag functions above this cognitive complexity"
+    )
+    parser.add_argument(
+        "--max-halstead", type=float, default=None,
+        help="also flag functions above this Halstead volume"
+    )
+    parser.add_argument(
+        "--max-params", type=int, default=None,
+        help="also flag functions taking more parameters than this"
+    )
+
+def thresholds_from_args(args):
+    # a threshold set to a negative number turns that criterion off
+    thresholds = {
+        "branch_count": args.max_branches,
+        "depth": args.max_depth,
+        "lines": args.max_lines,
+        "cyclomatic": args.max_cyclomatic,
+        "cognitive": args.max_cognitive,
+        "halstead_volume": args.max_halstead,
+        "params": args.max_params,
+    }
+    return {
+        key: limit for key, limit in thresholds.items()
+        if limit is not None and limit >= 0
+    }
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="analyze",
+        description="Report functions that are too complex to leave undocumented."
+    )
+    add_common_arguments(parser)
+    parser.add_argument(
+        "--cache", metavar="DB", default=None,
+        help="reuse results from this SQLite cache (see cache.py stats)"
+    )
+    parser.add_argument(
+        "--regenerate", action="store_true",
+        help="also report functions whose docstring already covers the signature"
+    )
+    parser.add_argument(
+        "--timings", metavar="JSON", default=None,
+        help="write per-phase timings for every file and the run to this file"
+    )
+    parser.add_argument(
+        "--profile", metavar="DIR", default=None,
+        help="dump a cProfile/pstats file per analyzed file into this directory"
+    )
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="keep running and report functions that become flagged or cleared"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=1.0,
+        help="seconds between polls when inotify is not used (default: 1.0)"
+    )
+    parser.add_argument(
+        "--poll", action="store_true",
+        help="poll file mtimes even where inotify is available"
+    )
+    parser.add_argument(
+        "--failures", metavar="JSON", default=None,
+        help="write the files that could not be fully analyzed to this file"
+    )
+    args = parser.parse_args(argv)
+
+    if args.watch:
+        try:
+            watch(
+                args.paths,
+                cache_path=args.cache,
+                thresholds=thresholds_from_args(args),
+                regenerate=args.regenerate,
+                interval=args.interval,
+                use_inotify=not args.poll
+            )
+        except KeyboardInterrupt:
+            pass
+        return
+
+    file_timings = {} if args.timings else None
+    failures = {}
+    report = analyze_paths(
+        args.paths,
+        jobs=args.jobs,
+        cache_path=args.cache,
+        thresholds=thresholds_from_args(args),
+        regenerate=args.regenerate,
+        file_timings=file_timings,
+        profile_dir=args.profile,
+        failures=failures
+    )
+    print_report(report)
+    print_failures(failures)
+
+    if args.timings:
+        totals = PhaseTimer()
+        for timings in file_timings.values():
+            totals.merge(timings)
+        write_timings(args.timings, totals.as_dict(), file_timings)
+
+    if args.failures:
+        with open(args.failures, "w") as f:
+            json.dump(failures, f, indent=2)
+    if failures:
+        sys.exit(1)
+
 if __name__ == '__main__':
-    with open("analyze.py", "r") as f:
-        src = f.read()
-    # print(main(src))
-    ng = main(src)
-
-    for name, info in ng.items():
-        print("----")
-        print(f"NG FUNCTION: {name}")
-        print(f"Defined at line: {info['line']}")
-        print(info["src"])
\ No newline at end of file
+    cli()
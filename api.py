@@ -1,32 +1,133 @@
 import sys
 import os
+import json
+import time
+import asyncio
+import threading
+import httpx
 from google import genai
 from dotenv import load_dotenv # API key (environment variable) is in .env file
 
-def api_call(file, function):
-    # read .env file and load variables into the system
-    load_dotenv()
+from cache import (
+    DEFAULT_RESPONSE_DB,
+    DEFAULT_RESPONSE_MAX_BYTES,
+    DEFAULT_RESPONSE_TTL,
+    ResponseCache,
+    config_hash,
+    content_hash,
+)
+from mock_gemini import MockClient
+from ratelimit import (
+    DEFAULT_RPM,
+    DEFAULT_TPM,
+    MAX_RETRIES,
+    RateLimiter,
+    backoff_delay,
+    is_retryable,
+    is_throttle,
+)
 
-    # check if API key was found
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        print("Error: API key not found.")
-        sys.exit(1) # error code
+MODEL = "gemini-2.5-flash"
 
-    # the client gets the API key from the environment variable `GEMINI_API_KEY`.
-    client = genai.Client(api_key=api_key)
+# part of every response cache key; bump it whenever build_prompt,
+# batch_prompt, cached_prefix, cached_function_prompt or RULES_JP change so
+# replies to the old prompts are not reused
+PROMPT_VERSION = 1
 
-    code_content = file
+# seconds an idle connection is kept open for the next call, and how many
+# connections are kept; both can be set in .env
+DEFAULT_KEEPALIVE = 30.0
+DEFAULT_MAX_CONNECTIONS = 10
 
-    # API call prompt
-    # 日本語
-    prompt_jp = f'''
-    あなたは、以下のPythonコードを作成した経験豊富なプログラマです。
-    他の開発者がコードの動作を理解できるように、特定の関数にコメント（docstring）を追加しようとしています。
+# input tokens per batched request, and a cap on functions per request so
+# the reply stays well inside the output limit
+DEFAULT_BATCH_TOKENS = 30000
+MAX_BATCH_FUNCTIONS = 20
+# rough size of one docstring in the reply
+REPLY_TOKENS_PER_FUNCTION = 400
 
-    指定されたコードの中から「{function}」という名前の関数を見つけ、その機能の要約、引数、戻り値、副作用、送出される例外、および制約事項を記載した複数行のdocstringを作成してください。
+# seconds the API keeps a file's cached context; refreshed while in use
+CONTEXT_CACHE_TTL = 600
+# the API will not cache a context smaller than this for 2.5 Flash
+MIN_CONTEXT_CACHE_TOKENS = 1024
+# rough prefill throughput, only used to put a time on the tokens the
+# context cache saved
+PREFILL_TOKENS_PER_SECOND = 10000
+
+# requests in flight at once for the async calls, and seconds before one of
+# them is given up on
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 120.0
+
+_client = None
+_limiter = None
+_responses = None
+_env_loaded = False
+_client_lock = threading.Lock()
+
+def load_env():
+    # read .env file and load variables into the system, once per process
+    global _env_loaded
+    if not _env_loaded:
+        load_dotenv()
+        _env_loaded = True
+
+def make_client(api_key, keepalive=DEFAULT_KEEPALIVE,
+                max_connections=DEFAULT_MAX_CONNECTIONS):
+    # the SDK keeps one httpx connection pool for client.models and another
+    # for client.aio.models; both get the same limits (with aiohttp installed
+    # the SDK uses that for async calls instead and ignores them)
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=keepalive
+    )
+    return genai.Client(
+        api_key=api_key,
+        http_options={
+            "client_args": {"limits": limits},
+            "async_client_args": {"limits": limits},
+        }
+    )
 
-    1. Docstringは3つのダブルクォートで開始し、同じ行に関数の概要を記述する
+def get_client():
+    # .env is read and the client built on the first call only; every later
+    # call reuses its open connections
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                load_env()
+
+                # GEMINI_BACKEND=mock answers locally, without a key
+                if os.getenv("GEMINI_BACKEND") == "mock":
+                    _client = MockClient(
+                        float(os.getenv("GEMINI_MOCK_LATENCY", 0)),
+                        float(os.getenv("GEMINI_MOCK_PREFILL_RATE", "inf"))
+                    )
+                    return _client
+
+                # check if API key was found
+                api_key = os.getenv("GEMINI_API_KEY")
+                if not api_key:
+                    print("Error: API key not found.")
+                    sys.exit(1) # error code
+
+                _client = make_client(
+                    api_key,
+                    float(os.getenv("GEMINI_KEEPALIVE", DEFAULT_KEEPALIVE)),
+                    int(os.getenv("GEMINI_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS))
+                )
+    return _client
+
+def set_client(client):
+    # injects a client, e.g. a local mock; None rebuilds it on the next call
+    global _client
+    with _client_lock:
+        _client = client
+
+# numbered rules and example shared by every Japanese prompt
+RULES_JP = f'''    1. Docstringは3つのダブルクォートで開始し、同じ行に関数の概要を記述する
     2. その直後に空行を1つ挿入する
     3. 続いて、引数、戻り値、発生する例外が存在する場合のみ、それぞれ記載する
     4. 値が複合データ構造を持つ場合、例示ではなく値の名称と共にその構造を明記する
@@ -60,7 +161,20 @@ def api_call(file, function):
 
     送出する例外:
         ValueError: 付与するレベルが無効な場合
-    """
+    """'''
+
+def build_prompt(file, function):
+    code_content = file
+
+    # API call prompt
+    # 日本語
+    prompt_jp = f'''
+    あなたは、以下のPythonコードを作成した経験豊富なプログラマです。
+    他の開発者がコードの動作を理解できるように、特定の関数にコメント（docstring）を追加しようとしています。
+
+    指定されたコードの中から「{function}」という名前の関数を見つけ、その機能の要約、引数、戻り値、副作用、送出される例外、および制約事項を記載した複数行のdocstringを作成してください。
+
+{RULES_JP}
 
     対象コード：
     {code_content}
@@ -119,19 +233,443 @@ def api_call(file, function):
     {function}
     '''
 
+    return prompt_jp
+
+def get_limiter():
+    # one limiter for every call of the process, sync and async alike
+    global _limiter
+    if _limiter is None:
+        with _client_lock:
+            if _limiter is None:
+                load_env()
+                # a full batch is the largest prompt sent routinely
+                _limiter = RateLimiter(
+                    int(os.getenv("GEMINI_RPM", DEFAULT_RPM)),
+                    int(os.getenv("GEMINI_TPM", DEFAULT_TPM)),
+                    DEFAULT_BATCH_TOKENS
+                )
+    return _limiter
+
+def set_limiter(limiter):
+    global _limiter
+    with _client_lock:
+        _limiter = limiter
+
+def get_response_cache():
+    # GEMINI_CACHE names the database, or turns the cache off with "off";
+    # GEMINI_CACHE_READONLY=1 looks replies up without ever storing any
+    global _responses
+    if _responses is None:
+        with _client_lock:
+            if _responses is None:
+                load_env()
+                path = os.getenv("GEMINI_CACHE", DEFAULT_RESPONSE_DB)
+                if path in ("", "off"):
+                    _responses = False
+                else:
+                    _responses = ResponseCache(
+                        path,
+                        max_bytes=int(float(os.getenv(
+                            "GEMINI_CACHE_MAX_MB", DEFAULT_RESPONSE_MAX_BYTES / 2**20
+                        )) * 2**20),
+                        ttl=float(os.getenv("GEMINI_CACHE_TTL", DEFAULT_RESPONSE_TTL)),
+                        read_only=os.getenv("GEMINI_CACHE_READONLY", "") not in ("", "0")
+                    )
+    return _responses or None
+
+def set_response_cache(cache):
+    # False turns caching off, None reopens it from the environment
+    global _responses
+    with _client_lock:
+        _responses = cache
+
+def response_key(template, function, context, function_hash=None):
+    # template names the prompt that was sent: "single" for build_prompt,
+    # "batch" for batch_prompt and "cached" for cached_function_prompt, whose
+    # replies differ in shape. The context already contains the function,
+    # but its hash is kept apart so callers can key on the normalized
+    # function.
+    return config_hash({
+        "model": MODEL,
+        "prompt": PROMPT_VERSION,
+        "template": template,
+        "function": function,
+        "function_hash": function_hash or "",
+        "context": content_hash(context),
+    })
+
+def generate_content(client, prompt, config=None):
+    # one request under the shared rate limit, retried with backoff on 429,
+    # 5xx and dropped connections
+    limiter = get_limiter()
+    tokens = estimate_tokens(prompt)
+    attempt = 0
+    while True:
+        limiter.acquire(tokens)
+        try:
+            response = client.models.generate_content(
+                model=MODEL,
+                contents=prompt,
+                config=config
+            )
+        except Exception as e:
+            if attempt >= MAX_RETRIES or not is_retryable(e):
+                raise
+            if is_throttle(e):
+                limiter.throttled()
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+            continue
+
+        limiter.succeeded()
+        return response
+
+async def generate_content_async(client, prompt, config=None, timeout=None):
+    # generate_content for the async client; timeout is one deadline for the
+    # whole call, waits and retries included
+    limiter = get_limiter()
+    tokens = estimate_tokens(prompt)
+    attempt = 0
+    async with asyncio.timeout(timeout):
+        while True:
+            await asyncio.sleep(limiter.reserve(tokens))
+            try:
+                response = await client.aio.models.generate_content(
+                    model=MODEL,
+                    contents=prompt,
+                    config=config
+                )
+            except Exception as e:
+                if attempt >= MAX_RETRIES or not is_retryable(e):
+                    raise
+                if is_throttle(e):
+                    limiter.throttled()
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            limiter.succeeded()
+            return response
+
+def api_call(file, function, client=None, function_hash=None):
+    responses = get_response_cache()
+    if responses is not None:
+        key = response_key("single", function, file, function_hash)
+        cached = responses.get(key)
+        if cached is not None:
+            return cached
+
+    client = client or get_client()
+    prompt_jp = build_prompt(file, function)
+
     # API call
     print("calling API")
-    response = client.models.generate_content(
-        model="gemini-2.5-flash", 
-        contents=prompt_jp
-    )
+    response = generate_content(client, prompt_jp)
 
     # write commented code to the file
     # with open (filename, "w", encoding="utf-8") as f:
     #     f.write(response.text)
     print(response.text)
     print("OK")
+    # text is None for blocked or empty candidates; that is not worth keeping
+    if responses is not None and response.text is not None:
+        responses.put(key, response.text)
+    return response.text
+
+async def api_call_async(file, function, client=None, timeout=DEFAULT_TIMEOUT,
+                         function_hash=None):
+    # same request as api_call through the SDK's async client; raises
+    # TimeoutError when it takes longer than timeout seconds, retries included
+    responses = get_response_cache()
+    if responses is not None:
+        key = response_key("single", function, file, function_hash)
+        cached = responses.get(key)
+        if cached is not None:
+            return cached
+
+    client = client or get_client()
+
+    print("calling API")
+    response = await generate_content_async(
+        client, build_prompt(file, function), timeout=timeout
+    )
+    print("OK")
+    if responses is not None and response.text is not None:
+        responses.put(key, response.text)
     return response.text
 
+async def api_call_many(calls, concurrency=DEFAULT_CONCURRENCY, client=None,
+                        timeout=DEFAULT_TIMEOUT):
+    # calls: (file, function) or (file, function, function_hash) tuples; the
+    # replies come back in the same order and at most concurrency requests
+    # are in flight at once. A call that failed or timed out comes back as
+    # its exception, so the others are not lost with it.
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(file, function, function_hash=None):
+        async with semaphore:
+            return await api_call_async(
+                file, function, client, timeout, function_hash
+            )
+
+    return await asyncio.gather(
+        *(bounded(*call) for call in calls), return_exceptions=True
+    )
+
+def cached_prefix(file):
+    # the part of build_prompt that is the same for every function of a file
+    code_content = file
+
+    return f'''
+    あなたは、以下のPythonコードを作成した経験豊富なプログラマです。
+    他の開発者がコードの動作を理解できるように、特定の関数にコメント（docstring）を追加しようとしています。
+
+{RULES_JP}
+
+    対象コード：
+    {code_content}
+    '''
+
+def cached_function_prompt(function, line):
+    # what is sent per function on top of cached_prefix; the line tells apart
+    # a name defined twice under if/else
+    return f'''
+    上記の対象コードの{line}行目で定義されている「{function}」という名前の関数を見つけ、その機能の要約、引数、戻り値、副作用、送出される例外、および制約事項を記載した複数行のdocstringを作成してください。
+
+    対象関数：
+    {function}
+    '''
+
+class ContextCacheStats:
+    # what explicit context caching saved over one run
+    def __init__(self):
+        self.caches = 0
+        self.uploaded_bytes = 0
+        self.requests = 0
+        self.sent_bytes = 0
+        self.saved_bytes = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def created(self, size):
+        self.caches += 1
+        self.uploaded_bytes += size
+
+    def record(self, response, prompt_size, prefix_size):
+        self.requests += 1
+        self.sent_bytes += prompt_size
+        self.saved_bytes += prefix_size
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            self.prompt_tokens += usage.prompt_token_count or 0
+            self.cached_tokens += usage.cached_content_token_count or 0
+
+    def report(self):
+        # the prefix went up once per file instead of once per request
+        saved = self.saved_bytes - self.uploaded_bytes
+        seconds = self.cached_tokens / PREFILL_TOKENS_PER_SECOND
+        return (
+            f"context cache: {self.caches} files cached for {self.requests} requests, "
+            f"{saved} bytes not re-sent ({self.sent_bytes} sent per function), "
+            f"{self.cached_tokens}/{self.prompt_tokens} prompt tokens from cache, "
+            f"about {seconds:.1f}s of prefill saved"
+        )
+
+def api_call_context_cached(file, functions, client=None, ttl=CONTEXT_CACHE_TTL,
+                            stats=None):
+    # Uploads the file once as cached content and asks for each function
+    # with a short prompt against it. functions: (qualname, line,
+    # function_hash) triples of one file; returns {function_hash: docstring}.
+    # Files too small to cache, or with a single function left to ask for,
+    # get whole prompts.
+    responses = get_response_cache()
+    comments = {}
+    keys = {}
+    missing = []
+    for qualname, line, function_hash in functions:
+        if responses is not None:
+            keys[function_hash] = response_key(
+                "cached", qualname, file, function_hash
+            )
+            cached = responses.get(keys[function_hash])
+            if cached is not None:
+                comments[function_hash] = cached
+                continue
+        missing.append((qualname, line, function_hash))
+
+    if not missing:
+        return comments
+
+    client = client or get_client()
+    stats = stats if stats is not None else ContextCacheStats()
+    prefix = cached_prefix(file)
+    prefix_size = len(prefix.encode("utf-8"))
+
+    cache = None
+    if len(missing) > 1 and estimate_tokens(prefix) >= MIN_CONTEXT_CACHE_TOKENS:
+        try:
+            cache = client.caches.create(model=MODEL, config={
+                "contents": [prefix],
+                "ttl": f"{int(ttl)}s",
+                "display_name": f"docstrings {content_hash(file)[:12]}",
+            })
+        except Exception as e:
+            # 400: the API counted fewer tokens than the minimum
+            if getattr(e, "code", None) != 400:
+                raise
+
+    if cache is None:
+        for qualname, line, function_hash in missing:
+            comments[function_hash] = api_call(file, qualname, client, function_hash)
+        return comments
+
+    stats.created(prefix_size)
+    refreshed = time.monotonic()
+    try:
+        for qualname, line, function_hash in missing:
+            # rate limits can stretch a file past the TTL
+            if time.monotonic() - refreshed > ttl / 2:
+                client.caches.update(name=cache.name, config={"ttl": f"{int(ttl)}s"})
+                refreshed = time.monotonic()
+
+            prompt = cached_function_prompt(qualname, line)
+            print("calling API")
+            response = generate_content(client, prompt, {"cached_content": cache.name})
+            print(response.text)
+            print("OK")
+
+            stats.record(response, len(prompt.encode("utf-8")), prefix_size)
+            comments[function_hash] = response.text
+            if responses is not None and response.text is not None:
+                responses.put(keys[function_hash], response.text)
+    finally:
+        client.caches.delete(name=cache.name)
+
+    return comments
+
+def estimate_tokens(text):
+    # about four bytes per token for code; Japanese text takes more tokens
+    # per character and also more bytes, so this stays in the right range
+    return len(text.encode("utf-8")) // 4 + 1
+
+def batch_prompt(functions):
+    # functions: (qualname, code) pairs
+    targets = "\n".join(f"    - {qualname}" for qualname, code in functions)
+    sections = "\n".join(
+        f"""
+    対象関数：{qualname}
+    対象コード：
+    {code}
+"""
+        for qualname, code in functions
+    )
+
+    return f'''
+    あなたは、以下のPythonコードを作成した経験豊富なプログラマです。
+    他の開発者がコードの動作を理解できるように、複数の関数にコメント（docstring）を追加しようとしています。
+
+    以下に列挙した各関数を、それぞれの対象コードの中から見つけ、その機能の要約、引数、戻り値、副作用、送出される例外、および制約事項を記載した複数行のdocstringを作成してください。
+    結果は、関数名をキー、docstringを値とするJSONオブジェクトとして返してください。
+
+{RULES_JP}
+
+    対象関数の一覧：
+{targets}
+{sections}'''
+
+def batch_schema(qualnames):
+    return {
+        "type": "OBJECT",
+        "properties": {qualname: {"type": "STRING"} for qualname in qualnames},
+        "required": list(qualnames),
+    }
+
+def plan_batches(functions, token_budget=DEFAULT_BATCH_TOKENS,
+                 max_functions=MAX_BATCH_FUNCTIONS):
+    # Groups (qualname, code, ...) tuples into requests that fit the token
+    # budget. Names stay unique within a request since they are the keys of
+    # the reply; a function too large for the budget goes alone.
+    overhead = estimate_tokens(batch_prompt([]))
+    batches = []
+    batch = []
+    names = set()
+    used = overhead
+
+    for item in functions:
+        qualname, code = item[0], item[1]
+        cost = estimate_tokens(code) + estimate_tokens(qualname) * 2 \
+            + REPLY_TOKENS_PER_FUNCTION
+        if batch and (
+            used + cost > token_budget
+            or len(batch) >= max_functions
+            or qualname in names
+        ):
+            batches.append(batch)
+            batch = []
+            names = set()
+            used = overhead
+        batch.append(item)
+        names.add(qualname)
+        used += cost
+
+    if batch:
+        batches.append(batch)
+    return batches
+
+def parse_batch_reply(text, qualnames):
+    # keeps only the requested names that came back as strings; whatever is
+    # missing is left for the caller to ask for one by one
+    try:
+        reply = json.loads(text)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(reply, dict):
+        return {}
+    return {
+        qualname: reply[qualname].strip()
+        for qualname in qualnames
+        if isinstance(reply.get(qualname), str)
+    }
+
+def api_call_batch(functions, client=None):
+    # functions: (qualname, code) or (qualname, code, function_hash) tuples;
+    # returns {qualname: docstring}, asking the model only for the ones that
+    # are not cached
+    responses = get_response_cache()
+    comments = {}
+    keys = {}
+    if responses is not None:
+        missing = []
+        for qualname, code, *rest in functions:
+            keys[qualname] = response_key("batch", qualname, code, *rest)
+            cached = responses.get(keys[qualname])
+            if cached is None:
+                missing.append((qualname, code))
+            else:
+                comments[qualname] = cached
+        functions = missing
+    else:
+        functions = [(qualname, code) for qualname, code, *rest in functions]
+
+    if not functions:
+        return comments
+
+    client = client or get_client()
+    qualnames = [qualname for qualname, code in functions]
+
+    print(f"calling API ({len(functions)} functions)")
+    response = generate_content(client, batch_prompt(functions), {
+        "response_mime_type": "application/json",
+        "response_schema": batch_schema(qualnames),
+    })
+
+    answers = parse_batch_reply(response.text, qualnames)
+    print("OK")
+    if responses is not None:
+        for qualname, comment in answers.items():
+            responses.put(keys[qualname], comment)
+    comments.update(answers)
+    return comments
+
 if __name__ == '__main__':
     api_call()
\ No newline at end of file
@@ -0,0 +1,184 @@
+import sys
+import ast
+import json
+import time
+import platform
+import argparse
+import resource
+import statistics
+import tracemalloc
+
+import synth
+import analyze
+
+CORPUS = ["dummy1.py", "dummy2.py", "dummy3.py", "dummy4.py"]
+
+# dummy3.py repeated this many times stands in for a large module
+DEFAULT_SCALES = [4, 16]
+
+def run_split_functions(src):
+    analyze.split_functions(src)
+
+def run_count_code_lines(src):
+    analyze.count_code_lines_from_src(src)
+
+def run_condition_counter(tree):
+    analyze.ConditionCounter().visit(tree)
+
+def run_main(src):
+    analyze.main(src)
+
+# stage name -> (prepare, run); only run is timed
+STAGES = {
+    "split_functions": (None, run_split_functions),
+    "count_code_lines_from_src": (None, run_count_code_lines),
+    "ConditionCounter": (ast.parse, run_condition_counter),
+    "main": (None, run_main),
+}
+
+def load_inputs(corpus, scales, synthetic=()):
+    inputs = {}
+    for path in corpus:
+        inputs[path] = analyze.read_source(path)
+
+    if scales:
+        base = analyze.read_source("dummy3.py")
+        for scale in scales:
+            inputs[f"dummy3.py x{scale}"] = "\n".join([base] * scale)
+
+    for functions in synthetic:
+        inputs[f"synth n={functions}"] = synth.generate_module(functions)
+
+    return inputs
+
+def measure(run, arg, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(arg)
+        times.append(time.perf_counter() - start)
+
+    # one extra run under tracemalloc so its overhead stays out of the timings
+    tracemalloc.start()
+    run(arg)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "best_s": min(times),
+        "median_s": statistics.median(times),
+        "peak_alloc_bytes": peak,
+    }
+
+def run_benchmarks(inputs, stages, repeat):
+    results = {}
+
+    for name, src in inputs.items():
+        functions = len(analyze.collect_function_metrics(src))
+        lines = src.count("\n") + 1
+        results[name] = {}
+
+        for stage in stages:
+            prepare, run = STAGES[stage]
+            arg = prepare(src) if prepare else src
+
+            result = measure(run, arg, repeat)
+            result["functions"] = functions
+            result["lines"] = lines
+            result["functions_per_s"] = functions / result["best_s"] if result["best_s"] else 0.0
+            results[name][stage] = result
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        # ru_maxrss is kilobytes on Linux and bytes on macOS
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            // (1024 if sys.platform == "darwin" else 1),
+        "results": results,
+    }
+
+def print_results(report):
+    print(f"{'input':<20} {'stage':<26} {'best ms':>9} {'median ms':>10} "
+          f"{'funcs/s':>10} {'peak alloc KB':>14}")
+    for name, stages in report["results"].items():
+        for stage, result in stages.items():
+            print(
+                f"{name:<20} {stage:<26} {result['best_s'] * 1000:9.2f} "
+                f"{result['median_s'] * 1000:10.2f} {result['functions_per_s']:10.0f} "
+                f"{result['peak_alloc_bytes'] / 1024:14.0f}"
+            )
+    print(f"peak RSS: {report['peak_rss_kb']} KB")
+
+def compare(baseline, report, tolerance):
+    # returns the (input, stage) pairs that got slower than the tolerance
+    regressions = []
+
+    for name, stages in report["results"].items():
+        for stage, result in stages.items():
+            base = baseline["results"].get(name, {}).get(stage)
+            if base is None:
+                continue
+
+            ratio = result["best_s"] / base["best_s"] if base["best_s"] else 1.0
+            marker = ""
+            if ratio > 1 + tolerance:
+                regressions.append((name, stage, ratio))
+                marker = "  REGRESSION"
+            print(f"{name:<20} {stage:<26} {ratio:6.2f}x{marker}")
+
+    return regressions
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="bench",
+        description="Benchmark the analysis stages over the dummy corpus."
+    )
+    parser.add_argument(
+        "inputs", nargs="*", default=CORPUS,
+        help="files to benchmark (default: dummy1.py .. dummy4.py)"
+    )
+    parser.add_argument(
+        "--scale", type=int, nargs="*", default=DEFAULT_SCALES,
+        help="also benchmark dummy3.py repeated this many times"
+    )
+    parser.add_argument(
+        "--synthetic", type=int, nargs="*", default=[],
+        help="also benchmark synth.py modules with this many functions"
+    )
+    parser.add_argument(
+        "--stage", choices=list(STAGES), action="append",
+        help="only run these stages (default: all)"
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("--save", metavar="JSON", help="write the results here")
+    parser.add_argument(
+        "--compare", metavar="JSON",
+        help="compare against a saved baseline; exits 1 on regressions"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.10,
+        help="allowed slowdown against the baseline (default: 0.10)"
+    )
+    args = parser.parse_args(argv)
+
+    inputs = load_inputs(args.inputs, args.scale, args.synthetic)
+    report = run_benchmarks(inputs, args.stage or list(STAGES), args.repeat)
+    print_results(report)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        if compare(baseline, report, args.tolerance):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,329 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+import hashlib
+import argparse
+
+DEFAULT_DB = ".analyze_cache.sqlite"
+DEFAULT_MAX_ENTRIES = 100000
+
+DEFAULT_RESPONSE_DB = ".response_cache.sqlite"
+DEFAULT_RESPONSE_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_RESPONSE_TTL = 30 * 24 * 3600
+
+def content_hash(text):
+    return hashlib.sha1(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+def config_hash(config):
+    return content_hash(json.dumps(config, sort_keys=True))
+
+class AnalysisCache:
+    # Two levels: whole files (path + content hash + threshold config) map to
+    # the flagged result, and single functions (hash of their source) map to
+    # their metrics, so an edit only re-scores the functions it touched.
+    def __init__(self, path=DEFAULT_DB, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                config_hash TEXT NOT NULL,
+                result TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (path, content_hash, config_hash)
+            );
+            CREATE TABLE IF NOT EXISTS functions (
+                function_hash TEXT PRIMARY KEY,
+                metrics TEXT NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS files_last_used ON files (last_used);
+            CREATE INDEX IF NOT EXISTS functions_last_used ON functions (last_used);
+        """)
+        self.counts = {
+            "file_hits": 0,
+            "file_misses": 0,
+            "function_hits": 0,
+            "function_misses": 0,
+        }
+
+    def get_file(self, path, file_hash, thresholds_hash):
+        row = self.conn.execute(
+            "SELECT result FROM files"
+            " WHERE path = ? AND content_hash = ? AND config_hash = ?",
+            (path, file_hash, thresholds_hash)
+        ).fetchone()
+
+        if row is None:
+            self.counts["file_misses"] += 1
+            return None
+
+        self.counts["file_hits"] += 1
+        self.conn.execute(
+            "UPDATE files SET last_used = ?"
+            " WHERE path = ? AND content_hash = ? AND config_hash = ?",
+            (time.time(), path, file_hash, thresholds_hash)
+        )
+        return json.loads(row[0])
+
+    def put_file(self, path, file_hash, thresholds_hash, result):
+        # older versions of the same file are never looked up again
+        self.conn.execute(
+            "DELETE FROM files WHERE path = ? AND content_hash != ?",
+            (path, file_hash)
+        )
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+            (path, file_hash, thresholds_hash, json.dumps(result), time.time())
+        )
+
+    def get_function(self, function_hash):
+        row = self.conn.execute(
+            "SELECT metrics FROM functions WHERE function_hash = ?",
+            (function_hash,)
+        ).fetchone()
+
+        if row is None:
+            self.counts["function_misses"] += 1
+            return None
+
+        self.counts["function_hits"] += 1
+        self.conn.execute(
+            "UPDATE functions SET last_used = ? WHERE function_hash = ?",
+            (time.time(), function_hash)
+        )
+        return json.loads(row[0])
+
+    def put_function(self, function_hash, metrics):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO functions VALUES (?, ?, ?)",
+            (function_hash, json.dumps(metrics), time.time())
+        )
+
+    def evict(self):
+        for table in ("files", "functions"):
+            (count,) = self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+            excess = count - self.max_entries
+            if excess > 0:
+                self.conn.execute(
+                    f"DELETE FROM {table} WHERE rowid IN ("
+                    f" SELECT rowid FROM {table} ORDER BY last_used LIMIT ?)",
+                    (excess,)
+                )
+
+    def commit(self):
+        self.evict()
+        for name, value in self.counts.items():
+            self.conn.execute(
+                "INSERT INTO stats VALUES (?, ?)"
+                " ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                (name, value)
+            )
+            self.counts[name] = 0
+        self.conn.commit()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def stats(self):
+        totals = dict(self.conn.execute("SELECT name, value FROM stats"))
+        for name, value in self.counts.items():
+            totals[name] = totals.get(name, 0) + value
+
+        result = {}
+        for level in ("file", "function"):
+            hits = totals.get(f"{level}_hits", 0)
+            misses = totals.get(f"{level}_misses", 0)
+            (entries,) = self.conn.execute(
+                f"SELECT COUNT(*) FROM {level}s"
+            ).fetchone()
+            result[level] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+                "entries": entries,
+            }
+        return result
+
+    def clear(self):
+        self.conn.executescript("""
+            DELETE FROM files;
+            DELETE FROM functions;
+            DELETE FROM stats;
+        """)
+        self.conn.commit()
+
+class ResponseCache:
+    # Model replies keyed by whatever went into the request, evicted least
+    # recently used first once there are too many or they take too much
+    # space, and ignored once older than ttl seconds. A read-only cache never
+    # writes, which suits CI runs against a cache checked in or restored from
+    # an artifact.
+    def __init__(self, path=DEFAULT_RESPONSE_DB, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_RESPONSE_MAX_BYTES, ttl=DEFAULT_RESPONSE_TTL,
+                 read_only=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.read_only = read_only
+        self.lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0}
+
+        if read_only:
+            if not os.path.exists(path):
+                # nothing to read; every lookup is a miss
+                self.conn = None
+                return
+            self.conn = sqlite3.connect(
+                f"file:{path}?mode=ro", uri=True, check_same_thread=False
+            )
+            return
+
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+        """)
+
+    def get(self, key):
+        with self.lock:
+            row = None
+            if self.conn is not None:
+                row = self.conn.execute(
+                    "SELECT response FROM responses WHERE key = ? AND created > ?",
+                    (key, time.time() - self.ttl)
+                ).fetchone()
+
+            if row is None:
+                self.counts["misses"] += 1
+                return None
+
+            self.counts["hits"] += 1
+            if not self.read_only:
+                self.conn.execute(
+                    "UPDATE responses SET last_used = ? WHERE key = ?",
+                    (time.time(), key)
+                )
+                self.conn.commit()
+            return row[0]
+
+    def put(self, key, response):
+        # written straight away: every entry cost a model call
+        if self.read_only:
+            return
+        with self.lock:
+            now = time.time()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now)
+            )
+            self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        self.conn.execute(
+            "DELETE FROM responses WHERE created <= ?", (time.time() - self.ttl,)
+        )
+        count, size = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if count <= self.max_entries and size <= self.max_bytes:
+            return
+
+        # oldest first until both limits hold again
+        doomed = []
+        for key, entry_size in self.conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_used"
+        ):
+            if count <= self.max_entries and size <= self.max_bytes:
+                break
+            doomed.append((key,))
+            count -= 1
+            size -= entry_size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+    def stats(self):
+        entries, size = 0, 0
+        if self.conn is not None:
+            entries, size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        hits, misses = self.counts["hits"], self.counts["misses"]
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def clear(self):
+        self.conn.execute("DELETE FROM responses")
+        self.conn.commit()
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="cache",
+        description="Inspect the incremental analysis cache."
+    )
+    parser.add_argument("command", choices=["stats", "clear"])
+    parser.add_argument("--db", default=None, help="cache database path")
+    parser.add_argument(
+        "--responses", action="store_true",
+        help=f"the model response cache (default: {DEFAULT_RESPONSE_DB})"
+    )
+    args = parser.parse_args(argv)
+
+    db = args.db or (DEFAULT_RESPONSE_DB if args.responses else DEFAULT_DB)
+    if not os.path.exists(db):
+        print(f"Error: cache not found: {db}")
+        sys.exit(1)
+
+    if args.responses:
+        cache = ResponseCache(db)
+        if args.command == "clear":
+            cache.clear()
+            print("OK")
+            return
+        info = cache.stats()
+        print(f"responses: {info['entries']} entries, {info['bytes']} bytes")
+        return
+
+    cache = AnalysisCache(db)
+
+    if args.command == "clear":
+        cache.clear()
+        print("OK")
+        return
+
+    for level, info in cache.stats().items():
+        print(
+            f"{level}: {info['hits']} hits, {info['misses']} misses, "
+            f"hit ratio {info['hit_ratio']:.1%}, {info['entries']} entries"
+        )
+
+if __name__ == '__main__':
+    cli()
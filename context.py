@@ -0,0 +1,200 @@
+import ast
+import sys
+import copy
+import argparse
+
+from analyze import FunctionCollector, function_span, line_offsets, read_source
+
+# module-level statements longer than this are shown as NAME = ...
+MAX_STATEMENT_LINES = 10
+
+class ContextCollector(FunctionCollector):
+    # FunctionCollector that also remembers every class and function around
+    # each function, outermost first
+    def __init__(self):
+        super().__init__()
+        self.enclosing = {}
+
+    def visit_FunctionDef(self, node):
+        self.enclosing[node] = list(self.stack)
+        super().visit_FunctionDef(node)
+
+    def visit_AsyncFunctionDef(self, node):
+        self.enclosing[node] = list(self.stack)
+        super().visit_AsyncFunctionDef(node)
+
+def bound_names(stmt):
+    if isinstance(stmt, (ast.Import, ast.ImportFrom)):
+        return [
+            alias.asname or alias.name.split(".")[0]
+            for alias in stmt.names
+        ]
+    if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return [stmt.name]
+    if isinstance(stmt, ast.Assign):
+        targets = stmt.targets
+    elif isinstance(stmt, (ast.AnnAssign, ast.AugAssign)):
+        targets = [stmt.target]
+    else:
+        return []
+    return [
+        node.id
+        for target in targets
+        for node in ast.walk(target)
+        if isinstance(node, ast.Name)
+    ]
+
+def stub(node, docstring=False):
+    # the def or class header, optionally with the first docstring line, and
+    # an ellipsis for a body
+    node = copy.copy(node)
+    body = []
+    doc = ast.get_docstring(node) if docstring else None
+    if doc:
+        body.append(ast.Expr(ast.Constant(doc.splitlines()[0])))
+    body.append(ast.Expr(ast.Constant(...)))
+    node.body = body
+    return ast.unparse(node)
+
+def header(node):
+    return stub(node).rsplit("\n", 1)[0]
+
+def indent(text, prefix):
+    return "\n".join(prefix + line if line else line for line in text.split("\n"))
+
+class ModuleContext:
+    # Parses a module once and cuts a prompt-sized slice out of it for any of
+    # its functions: the names it uses from module level, the signatures of
+    # what it calls, the headers of what encloses it, and its own source.
+    def __init__(self, src):
+        self.src = src
+        self.tree = ast.parse(src)
+        self.offsets = line_offsets(src)
+
+        collector = ContextCollector()
+        collector.visit(self.tree)
+        # a qualname defined twice under if/else is told apart by its line
+        self.functions = {
+            (qualname, fn.lineno): (fn, collector.enclosing[fn])
+            for fn, parent, qualname in collector.functions
+        }
+
+    def _line_prefix(self, node):
+        # indentation exactly as written, tabs included
+        start = self.offsets[node.lineno - 1]
+        return self.src[start:start + node.col_offset]
+
+    def _statement(self, stmt, names):
+        if isinstance(stmt, (ast.Import, ast.ImportFrom)):
+            stmt = copy.copy(stmt)
+            stmt.names = [
+                alias for alias in stmt.names
+                if (alias.asname or alias.name.split(".")[0]) in names
+            ]
+            return ast.unparse(stmt)
+
+        if stmt.end_lineno - stmt.lineno >= MAX_STATEMENT_LINES:
+            return f"{', '.join(bound_names(stmt))} = ..."
+
+        start = self.offsets[stmt.lineno - 1]
+        end = (
+            self.offsets[stmt.end_lineno]
+            if stmt.end_lineno < len(self.offsets) else len(self.src)
+        )
+        return self.src[start:end].rstrip("\n")
+
+    def _class_part(self, cls, calls_init):
+        if calls_init:
+            for item in cls.body:
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)) \
+                        and item.name == "__init__":
+                    return header(cls) + "\n" + indent(stub(item, True), "    ")
+        return stub(cls)
+
+    def slice(self, qualname, line):
+        fn, enclosing = self.functions[qualname, line]
+
+        used = set()
+        called = set()
+        self_called = set()
+        for node in ast.walk(fn):
+            if isinstance(node, ast.Name):
+                used.add(node.id)
+            elif isinstance(node, ast.Call):
+                func = node.func
+                if isinstance(func, ast.Name):
+                    called.add(func.id)
+                elif isinstance(func, ast.Attribute) \
+                        and isinstance(func.value, ast.Name) \
+                        and func.value.id in ("self", "cls"):
+                    self_called.add(func.attr)
+
+        skip = {id(node) for node in enclosing} | {id(fn)}
+        statements = []
+        parts = []
+
+        for stmt in self.tree.body:
+            if id(stmt) in skip:
+                continue
+
+            names = used.intersection(bound_names(stmt))
+            if not names:
+                continue
+
+            if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                parts.append(stub(stmt, True))
+            elif isinstance(stmt, ast.ClassDef):
+                parts.append(self._class_part(stmt, stmt.name in called))
+            else:
+                statements.append(self._statement(stmt, names))
+
+        # the enclosing classes and functions, outermost first, then the
+        # methods called through self on the innermost class
+        lines = []
+        for outer in enclosing:
+            lines.append(indent(header(outer), self._line_prefix(outer)))
+
+        classes = [outer for outer in enclosing if isinstance(outer, ast.ClassDef)]
+        if classes:
+            cls = classes[-1]
+            for item in cls.body:
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)) \
+                        and item.name in self_called and item is not fn:
+                    lines.append(indent(stub(item, True), self._line_prefix(item)))
+
+        lines.append(function_span(self.src, self.offsets, fn).src.rstrip("\n"))
+        parts.append("\n".join(lines))
+
+        if statements:
+            parts.insert(0, "\n".join(statements))
+        return "\n\n".join(parts) + "\n"
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="context",
+        description="Print the slice of a module that is sent to the model for one function."
+    )
+    parser.add_argument("path")
+    parser.add_argument("qualname", help="e.g. Class.method or outer.<locals>.inner")
+    parser.add_argument(
+        "line", nargs="?", type=int,
+        help="line of the def, when the qualname is defined more than once"
+    )
+    args = parser.parse_args(argv)
+
+    context = ModuleContext(read_source(args.path))
+    lines = [
+        line for qualname, line in context.functions
+        if qualname == args.qualname and args.line in (None, line)
+    ]
+    if not lines:
+        sys.exit(f"no function {args.qualname!r} in {args.path}")
+    if len(lines) > 1:
+        sys.exit(
+            f"{args.qualname!r} is defined at lines "
+            f"{', '.join(map(str, lines))}; give one of them"
+        )
+    sys.stdout.write(context.slice(args.qualname, lines[0]))
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,290 @@
+import os
+import sys
+import json
+import socket
+import asyncio
+import argparse
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from analyze import (
+    add_common_arguments,
+    analyze_paths,
+    collect_function_metrics,
+    describe_error,
+    find_python_files,
+    needs_docstring,
+    print_failures,
+    print_report,
+    report_key,
+    run_tolerant,
+    thresholds_from_args,
+)
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), f"analyze-{os.getuid()}.sock")
+DEFAULT_MAX_FILES = 1024
+
+# a request for a whole repository is one line of paths
+MAX_LINE = 64 * 1024 * 1024
+
+def load_file(path):
+    # the same recovery as the in-process run, so the answer does not depend
+    # on whether the daemon is up; runs in the daemon's worker pool
+    return run_tolerant(path, collect_function_metrics)
+
+class AnalysisDaemon:
+    # Keeps the scored functions of recently asked-for files, keyed by path
+    # and (mtime, size). A repeated question about an unchanged file costs
+    # one stat() and a threshold check. Files that have to be scored go to
+    # executor, so a cold request does not hold up the other clients.
+    def __init__(self, max_files=DEFAULT_MAX_FILES, executor=None):
+        self.max_files = max_files
+        self.executor = executor
+        self.files = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stopping = None
+
+    def lookup(self, path, signature):
+        entry = self.files.get(path)
+        if entry is None or entry[0] != signature:
+            return None
+        self.hits += 1
+        self.files.move_to_end(path)
+        return entry[1:]
+
+    def store(self, path, signature, metrics, failure):
+        self.files[path] = (signature, metrics, failure)
+        self.files.move_to_end(path)
+        while len(self.files) > self.max_files:
+            self.files.popitem(last=False)
+
+    async def analyze(self, paths, thresholds=None, regenerate=False):
+        loaded = {}
+        misses = {}
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                self.files.pop(path, None)
+                loaded[path] = e
+                continue
+            signature = (st.st_mtime_ns, st.st_size)
+            entry = self.lookup(path, signature)
+            if entry is None:
+                misses[path] = signature
+            else:
+                loaded[path] = entry
+
+        # the cache itself is only touched here, on the event loop
+        self.misses += len(misses)
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self.executor, load_file, path)
+            for path in misses
+        ), return_exceptions=True)
+        for (path, signature), result in zip(misses.items(), results):
+            if isinstance(result, Exception):
+                self.files.pop(path, None)
+            else:
+                self.store(path, signature, *result)
+            loaded[path] = result
+
+        report = {}
+        failures = {}
+        for path in paths:
+            result = loaded[path]
+            if isinstance(result, Exception):
+                metrics = []
+                failure = {"error": describe_error(result), "recovered": False,
+                           "skipped_lines": None}
+            else:
+                metrics, failure = result
+            if failure is not None:
+                failures[path] = failure
+
+            ng = {}
+            for m in metrics:
+                if needs_docstring(m, thresholds, regenerate):
+                    ng[report_key(ng, m)] = {"line": m.line, "src": m.span.src}
+            report[path] = ng
+        return report, failures
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "files": len(self.files),
+            "max_files": self.max_files,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+    async def dispatch(self, request):
+        op = request.get("op")
+        if op == "analyze":
+            report, failures = await self.analyze(
+                request["paths"],
+                request.get("thresholds"),
+                request.get("regenerate", False)
+            )
+            return {"report": report, "failures": failures}
+        if op == "stats":
+            return {"stats": self.stats()}
+        if op == "stop":
+            self.stopping.set()
+            return {"stopped": True}
+        return {"error": f"unknown op: {op!r}"}
+
+    async def handle(self, reader, writer):
+        # one JSON request per line, answered by one JSON line
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = await self.dispatch(json.loads(line))
+                except (ValueError, KeyError, TypeError) as e:
+                    response = {"error": f"bad request: {e}"}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+                if self.stopping.is_set():
+                    break
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path=DEFAULT_SOCKET):
+        self.stopping = asyncio.Event()
+        server = await asyncio.start_unix_server(
+            self.handle, path=socket_path, limit=MAX_LINE
+        )
+        os.chmod(socket_path, 0o600)
+        try:
+            async with server:
+                await self.stopping.wait()
+        finally:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+def request(socket_path, payload):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(payload).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("daemon closed the connection")
+    return json.loads(line)
+
+def is_running(socket_path):
+    try:
+        request(socket_path, {"op": "stats"})
+    except OSError:
+        return False
+    return True
+
+def serve(socket_path=DEFAULT_SOCKET, max_files=DEFAULT_MAX_FILES, jobs=None):
+    # jobs worker processes score the files that are not cached; with one
+    # job they are scored in a thread of the daemon itself
+    if os.path.exists(socket_path):
+        if is_running(socket_path):
+            sys.exit(f"a daemon is already listening on {socket_path}")
+        # left behind by a daemon that was killed
+        os.unlink(socket_path)
+
+    jobs = jobs or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    try:
+        asyncio.run(AnalysisDaemon(max_files, executor).serve(socket_path))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+def client(args):
+    files = find_python_files(args.paths)
+    thresholds = thresholds_from_args(args)
+
+    # the daemon has its own working directory, so it gets absolute paths
+    absolute = {os.path.abspath(path): path for path in files}
+    try:
+        response = request(args.socket, {
+            "op": "analyze",
+            "paths": list(absolute),
+            "thresholds": thresholds,
+            "regenerate": args.regenerate,
+        })
+    except OSError:
+        # no daemon: answer in-process so hooks keep working
+        failures = {}
+        print_report(analyze_paths(
+            args.paths, jobs=args.jobs, thresholds=thresholds,
+            regenerate=args.regenerate, failures=failures
+        ))
+        print_failures(failures)
+        if failures:
+            sys.exit(1)
+        return
+
+    if "error" in response:
+        sys.exit(response["error"])
+
+    print_report({
+        absolute[path]: ng for path, ng in response["report"].items()
+    })
+    print_failures({
+        absolute[path]: failure for path, failure in response["failures"].items()
+    })
+    if response["failures"]:
+        sys.exit(1)
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="daemon",
+        description="Keep analysis results in memory and answer over a Unix socket."
+    )
+    parser.add_argument(
+        "--socket", default=DEFAULT_SOCKET,
+        help=f"socket path (default: {DEFAULT_SOCKET})"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="run the daemon in the foreground")
+    serve_parser.add_argument(
+        "--max-files", type=int, default=DEFAULT_MAX_FILES,
+        help="number of files kept in memory"
+    )
+    serve_parser.add_argument(
+        "-j", "--jobs", type=int, default=None,
+        help="worker processes for files that are not cached (default: number of cores)"
+    )
+
+    analyze_parser = commands.add_parser(
+        "analyze", help="same output as analyze.py, answered by the daemon",
+        description="Same output as analyze.py, answered by the daemon. -j only "
+                    "applies when no daemon is running; the daemon scores with "
+                    "the workers it was started with (serve -j)."
+    )
+    add_common_arguments(analyze_parser)
+    analyze_parser.add_argument("--regenerate", action="store_true")
+
+    commands.add_parser("stats", help="print the daemon's cache statistics")
+    commands.add_parser("stop", help="shut the daemon down")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(args.socket, args.max_files, args.jobs)
+    elif args.command == "analyze":
+        client(args)
+    else:
+        try:
+            response = request(args.socket, {"op": args.command})
+        except OSError as e:
+            sys.exit(f"no daemon on {args.socket}: {e}")
+        print(json.dumps(response.get("stats", response), indent=2))
+
+if __name__ == '__main__':
+    cli()
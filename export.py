@@ -0,0 +1,145 @@
+import sys
+import csv
+import json
+import argparse
+from functools import partial
+
+from analyze import (
+    METRIC_NAMES,
+    add_common_arguments,
+    describe_error,
+    find_python_files,
+    iter_function_metrics,
+    map_files,
+    needs_docstring,
+    print_failures,
+    run_tolerant,
+    thresholds_from_args,
+)
+
+FIELDS = [
+    "path", "qualname", "name", "line", "start_line", "end_line",
+    *METRIC_NAMES,
+    "documented", "flagged", "hash",
+]
+
+def function_row(path, metrics, thresholds=None, regenerate=False, source=False):
+    row = {
+        "path": path,
+        "qualname": metrics.qualname,
+        "name": metrics.name,
+        "line": metrics.line,
+        "start_line": metrics.span.lineno,
+        "end_line": metrics.span.end_lineno,
+        **metrics.metrics(),
+        "documented": metrics.documented,
+        "flagged": needs_docstring(metrics, thresholds, regenerate),
+        # follows a function across commits as long as its text is unchanged
+        "hash": metrics.content_hash,
+    }
+    if source:
+        row["source"] = metrics.span.src
+    return row
+
+def export_file(path, thresholds=None, regenerate=False, source=False):
+    # rows of one file; the file's text is dropped before they go back
+    def run(src):
+        return [
+            function_row(path, metrics, thresholds, regenerate, source)
+            for metrics in iter_function_metrics(src)
+        ]
+
+    try:
+        rows, failure = run_tolerant(path, run)
+    except Exception as e:
+        rows = []
+        failure = {"error": describe_error(e), "recovered": False,
+                   "skipped_lines": None}
+    return path, rows, failure
+
+class JsonLinesWriter:
+    def __init__(self, f, fields):
+        self.f = f
+
+    def write(self, row):
+        self.f.write(json.dumps(row) + "\n")
+
+class CsvWriter:
+    def __init__(self, f, fields):
+        self.writer = csv.DictWriter(f, fieldnames=fields)
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+WRITERS = {
+    "jsonl": JsonLinesWriter,
+    "csv": CsvWriter,
+}
+
+def export(paths, f, fmt="jsonl", jobs=None, thresholds=None, regenerate=False,
+           source=False, failures=None):
+    # Writes every function as soon as its file is done, so memory holds at
+    # most a few files' rows whatever the size of the repository. Returns the
+    # number of rows written.
+    fields = FIELDS + ["source"] if source else FIELDS
+    writer = WRITERS[fmt](f, fields)
+    worker = partial(
+        export_file,
+        thresholds=thresholds,
+        regenerate=regenerate,
+        source=source
+    )
+
+    files = find_python_files(paths)
+    written = 0
+    for path, rows, failure in map_files(worker, files, jobs, bounded=True):
+        for row in rows:
+            writer.write(row)
+        written += len(rows)
+        if failure is not None and failures is not None:
+            failures[path] = failure
+    return written
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="export",
+        description="Write one record per function, for pandas, DuckDB and the like."
+    )
+    add_common_arguments(parser)
+    parser.add_argument("--format", choices=list(WRITERS), default="jsonl")
+    parser.add_argument(
+        "-o", "--output", default=None,
+        help="write here instead of stdout"
+    )
+    parser.add_argument(
+        "--source", action="store_true",
+        help="include each function's source text"
+    )
+    parser.add_argument(
+        "--regenerate", action="store_true",
+        help="count documented functions as flagged too"
+    )
+    args = parser.parse_args(argv)
+
+    failures = {}
+    options = dict(
+        fmt=args.format,
+        jobs=args.jobs,
+        thresholds=thresholds_from_args(args),
+        regenerate=args.regenerate,
+        source=args.source,
+        failures=failures
+    )
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            export(args.paths, f, **options)
+    else:
+        export(args.paths, sys.stdout, **options)
+
+    print_failures(failures)
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    cli()
@@ -1,18 +1,162 @@
-from api import api_call
-from analyze import main
+import asyncio
 
-def receiveFileAndReturnComment(file):
-    ng = main(file)
-    result = []
+from api import (
+    CONTEXT_CACHE_TTL,
+    DEFAULT_BATCH_TOKENS,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_TIMEOUT,
+    ContextCacheStats,
+    api_call,
+    api_call_batch,
+    api_call_context_cached,
+    api_call_many,
+    plan_batches,
+)
+from analyze import iter_flagged_functions
+from context import ModuleContext
 
-    for name, info in ng.items():
-        response = api_call(file, name)
-        result.append({
-            "line": info["line"],
-            "comment": response
-        })
+def receiveFilesAndReturnComments(files, regenerate=False):
+    # files maps a path to its source. Copies of the same function (same
+    # normalized AST) are sent to the model once and share the answer.
+    results = {}
+    responses = {}
 
-    return result
+    for path, file in files.items():
+        result = []
+        # the model sees only the slice of the file each function depends on
+        context = ModuleContext(file)
+
+        # each function is sent as soon as it is scored
+        for metrics in iter_flagged_functions(file, regenerate=regenerate):
+            key = metrics.normalized_hash
+            if key not in responses:
+                responses[key] = api_call(
+                    context.slice(metrics.qualname, metrics.line),
+                    metrics.qualname, function_hash=key
+                )
+            result.append({
+                "line": metrics.line,
+                "comment": responses[key]
+            })
+
+        results[path] = result
+
+    return results
+
+def collectFlaggedFunctions(files, regenerate=False):
+    # returns {path: [(line, key)]} and {key: (qualname, context, key)} with
+    # one entry per distinct function, for the callers that send everything
+    # at once
+    flagged = {}
+    pending = {}
+
+    for path, file in files.items():
+        context = ModuleContext(file)
+        flagged[path] = []
+        for metrics in iter_flagged_functions(file, regenerate=regenerate):
+            key = metrics.normalized_hash
+            if key not in pending:
+                code = context.slice(metrics.qualname, metrics.line)
+                pending[key] = (metrics.qualname, code, key)
+            flagged[path].append((metrics.line, key))
+
+    return flagged, pending
+
+def assembleComments(flagged, responses):
+    return {
+        path: [
+            {"line": line, "comment": responses[key]}
+            for line, key in functions
+        ]
+        for path, functions in flagged.items()
+    }
+
+def receiveFilesAndReturnCommentsBatched(files, regenerate=False,
+                                         token_budget=DEFAULT_BATCH_TOKENS):
+    # Same result as receiveFilesAndReturnComments, but several functions go
+    # into each request, as many as fit the token budget.
+    flagged, pending = collectFlaggedFunctions(files, regenerate)
+
+    responses = {}
+    for batch in plan_batches(list(pending.values()), token_budget):
+        comments = api_call_batch(batch)
+        for qualname, code, key in batch:
+            if qualname in comments:
+                responses[key] = comments[qualname]
+            else:
+                # missing or malformed in the batched reply
+                responses[key] = api_call(code, qualname, function_hash=key)
+
+    return assembleComments(flagged, responses)
+
+async def receiveFilesAndReturnCommentsAsync(files, regenerate=False,
+                                             concurrency=DEFAULT_CONCURRENCY,
+                                             timeout=DEFAULT_TIMEOUT):
+    # Same result as receiveFilesAndReturnComments with up to concurrency
+    # requests in flight, so a file takes about as long as its slowest call.
+    flagged, pending = collectFlaggedFunctions(files, regenerate)
+
+    calls = [(code, qualname, key) for qualname, code, key in pending.values()]
+    comments = await api_call_many(calls, concurrency, timeout=timeout)
+
+    # failed or timed out calls get one more concurrent round
+    failed = []
+    for call, comment in zip(calls, comments):
+        if isinstance(comment, Exception):
+            print(f"{call[1]} failed ({comment!r}), retrying")
+            failed.append(call)
+    retried = await api_call_many(failed, concurrency, timeout=timeout)
+
+    responses = dict(zip(pending, comments))
+    for (code, qualname, key), comment in zip(failed, retried):
+        if isinstance(comment, Exception):
+            # no comment for this one; the others are kept
+            print(f"{qualname} failed again ({comment!r})")
+            comment = None
+        responses[key] = comment
+
+    return assembleComments(flagged, responses)
+
+def receiveFilesAndReturnCommentsContextCached(files, regenerate=False,
+                                              ttl=CONTEXT_CACHE_TTL):
+    # Same result as receiveFilesAndReturnComments, but the model sees the
+    # whole file, uploaded once per file as cached content; prints what the
+    # cache saved at the end of the run.
+    stats = ContextCacheStats()
+    responses = {}
+    results = {}
+
+    for path, file in files.items():
+        flagged = list(iter_flagged_functions(file, regenerate=regenerate))
+        # functions already asked for in an earlier file are not asked again
+        missing = {}
+        for metrics in flagged:
+            key = metrics.normalized_hash
+            if key not in responses and key not in missing:
+                missing[key] = (metrics.qualname, metrics.line, key)
+
+        if missing:
+            responses.update(api_call_context_cached(
+                file, list(missing.values()), ttl=ttl, stats=stats
+            ))
+        results[path] = [
+            {"line": metrics.line, "comment": responses[metrics.normalized_hash]}
+            for metrics in flagged
+        ]
+
+    print(stats.report())
+    return results
+
+def receiveFileAndReturnComment(file, regenerate=False, batched=False,
+                                concurrency=None):
+    # concurrency sends the requests in parallel through the async client
+    if batched:
+        return receiveFilesAndReturnCommentsBatched({None: file}, regenerate)[None]
+    if concurrency:
+        return asyncio.run(receiveFilesAndReturnCommentsAsync(
+            {None: file}, regenerate, concurrency
+        ))[None]
+    return receiveFilesAndReturnComments({None: file}, regenerate)[None]
 
 if __name__ == '__main__':
     with open("dummy.py", "r") as f:
@@ -21,4 +165,4 @@ if __name__ == '__main__':
     for item in result:
         print(f"📍 {item['line']}行目へのコメント:")
         print(f"{item['comment']}")
-        print("-" * 30)
\ No newline at end of file
+        print("-" * 30)
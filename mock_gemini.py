@@ -0,0 +1,165 @@
+import json
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+
+# the real API refuses to cache less than this for 2.5 Flash
+MIN_CACHE_TOKENS = 1024
+
+class MockAPIError(Exception):
+    # carries .code like google.genai.errors.APIError, so retries and error
+    # handling take the same paths as against the real API
+    def __init__(self, code, message):
+        self.code = code
+        super().__init__(f"{code} {message}")
+
+def count_tokens(text):
+    return len(text.encode("utf-8")) // 4 + 1
+
+def content_text(contents):
+    # accepts a string or a list of strings/{"parts": [{"text": ...}]} dicts
+    if isinstance(contents, str):
+        return contents
+    parts = []
+    for item in contents or []:
+        if isinstance(item, str):
+            parts.append(item)
+        elif isinstance(item, dict):
+            parts.extend(part.get("text", "") for part in item.get("parts", []))
+    return "\n".join(parts)
+
+def config_value(config, name):
+    if config is None:
+        return None
+    if isinstance(config, dict):
+        return config.get(name)
+    return getattr(config, name, None)
+
+class MockModels:
+    def __init__(self, client):
+        self.client = client
+
+    def generate_content(self, model, contents, config=None):
+        text = content_text(contents)
+        cached_tokens = 0
+
+        cache_name = config_value(config, "cached_content")
+        if cache_name is not None:
+            cached_tokens = self.client.caches.lookup(cache_name).tokens
+
+        prompt_tokens = count_tokens(text)
+        self.client.record(prompt_tokens, cached_tokens)
+        # prefill only has to cover what the cache did not
+        time.sleep(self.client.latency + prompt_tokens / self.client.prefill_rate)
+
+        schema = config_value(config, "response_schema")
+        if schema is not None:
+            reply = json.dumps({
+                name: self.client.docstring(name) for name in schema["properties"]
+            })
+        else:
+            # prompts end with the name of the target function
+            target = text.strip().splitlines()[-1].strip() if text.strip() else ""
+            reply = self.client.docstring(target)
+
+        return SimpleNamespace(
+            text=reply,
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=prompt_tokens + cached_tokens,
+                cached_content_token_count=cached_tokens,
+                candidates_token_count=count_tokens(reply),
+            )
+        )
+
+class MockAsyncModels:
+    def __init__(self, models):
+        self.models = models
+
+    async def generate_content(self, model, contents, config=None):
+        return await asyncio.to_thread(
+            self.models.generate_content, model=model, contents=contents, config=config
+        )
+
+class MockCaches:
+    # cached contents with a TTL, named like the real ones
+    def __init__(self, client):
+        self.client = client
+        self.entries = {}
+        self.created = 0
+
+    def create(self, model, config=None):
+        text = "\n".join(filter(None, [
+            content_text(config_value(config, "system_instruction") or []),
+            content_text(config_value(config, "contents")),
+        ]))
+        tokens = count_tokens(text)
+        if tokens < MIN_CACHE_TOKENS:
+            raise MockAPIError(
+                400, f"cached content has {tokens} tokens, the minimum is {MIN_CACHE_TOKENS}"
+            )
+
+        with self.client.lock:
+            self.created += 1
+            name = f"cachedContents/mock-{self.created}"
+            entry = SimpleNamespace(
+                name=name,
+                model=model,
+                display_name=config_value(config, "display_name"),
+                tokens=tokens,
+                expires=time.monotonic() + parse_ttl(config_value(config, "ttl")),
+                usage_metadata=SimpleNamespace(total_token_count=tokens),
+            )
+            self.entries[name] = entry
+        # uploading and prefilling the whole context happens once, here
+        time.sleep(self.client.latency + tokens / self.client.prefill_rate)
+        return entry
+
+    def lookup(self, name):
+        entry = self.entries.get(name)
+        if entry is None or entry.expires <= time.monotonic():
+            self.entries.pop(name, None)
+            raise MockAPIError(404, f"cached content {name} not found or expired")
+        return entry
+
+    def get(self, name, config=None):
+        return self.lookup(name)
+
+    def update(self, name, config=None):
+        entry = self.lookup(name)
+        entry.expires = time.monotonic() + parse_ttl(config_value(config, "ttl"))
+        return entry
+
+    def delete(self, name, config=None):
+        self.entries.pop(name, None)
+
+def parse_ttl(ttl):
+    # "300s" as the API takes it; an hour when not given, like the API
+    if not ttl:
+        return 3600.0
+    return float(str(ttl).rstrip("s"))
+
+class MockClient:
+    # Offline stand-in for genai.Client. Replies with a placeholder
+    # docstring, reports token usage the way the API does, keeps cached
+    # contents with their TTL, and spends prefill time in proportion to the
+    # tokens that were not cached.
+    def __init__(self, latency=0.0, prefill_rate=float("inf")):
+        self.latency = latency
+        self.prefill_rate = prefill_rate
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.models = MockModels(self)
+        self.aio = SimpleNamespace(models=MockAsyncModels(self.models))
+        self.caches = MockCaches(self)
+
+    def record(self, prompt_tokens, cached_tokens):
+        with self.lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+
+    def docstring(self, function):
+        return f'"""{function} の概要\n"""'
@@ -0,0 +1,110 @@
+import time
+import random
+import threading
+
+import httpx
+
+# Gemini 2.5 Flash on the first paid tier; the free tier is far lower, so set
+# GEMINI_RPM and GEMINI_TPM in .env to match the project's quota
+DEFAULT_RPM = 1000
+DEFAULT_TPM = 1000000
+
+MAX_RETRIES = 6
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+# the rate halves on a 429, at most once per cooldown since the requests of
+# one burst fail together, and climbs back by RECOVERY_RATE of the full rate
+# per second of successful calls
+THROTTLE_FACTOR = 0.5
+THROTTLE_COOLDOWN = 2.0
+RECOVERY_RATE = 0.01
+MIN_SCALE = 0.05
+
+class TokenBucket:
+    # Refills at rate per second up to capacity. take() may leave the balance
+    # negative; the debt is the queue, so callers are served in the order
+    # they asked.
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount, now, rate):
+        # returns the seconds to wait before amount may be spent
+        self.rate = rate
+        self._refill(now)
+        self.tokens -= amount
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def drain(self, now):
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+
+class RateLimiter:
+    # Requests per minute and tokens per minute, shared by every call of the
+    # process. The allowed rate halves whenever the API throttles us and
+    # creeps back up with each success, settling just under the real quota.
+    # The buckets hold a second of quota, but never less than one request
+    # and one prompt of max_prompt_tokens, so an idle limiter lets the next
+    # call through at once even on low quotas.
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, max_prompt_tokens=0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.scale = 1.0
+        self.requests = TokenBucket(rpm / 60, max(1, rpm / 60))
+        self.tokens = TokenBucket(tpm / 60, min(tpm, max(tpm / 60, max_prompt_tokens)))
+        self.lock = threading.Lock()
+        self.throttles = 0
+        self.decreased = float("-inf")
+        self.increased = time.monotonic()
+
+    def reserve(self, tokens):
+        # books one request of this many tokens; returns how long to wait
+        # before sending it
+        with self.lock:
+            now = time.monotonic()
+            return max(
+                self.requests.take(1, now, self.rpm / 60 * self.scale),
+                self.tokens.take(tokens, now, self.tpm / 60 * self.scale),
+            )
+
+    def acquire(self, tokens):
+        time.sleep(self.reserve(tokens))
+
+    def throttled(self):
+        with self.lock:
+            self.throttles += 1
+            now = time.monotonic()
+            if now - self.decreased >= THROTTLE_COOLDOWN:
+                self.scale = max(MIN_SCALE, self.scale * THROTTLE_FACTOR)
+                self.decreased = now
+            self.increased = now
+            self.requests.drain(now)
+            self.tokens.drain(now)
+
+    def succeeded(self):
+        with self.lock:
+            now = time.monotonic()
+            self.scale = min(1.0, self.scale + RECOVERY_RATE * (now - self.increased))
+            self.increased = now
+
+def is_throttle(error):
+    return getattr(error, "code", None) == 429
+
+def is_retryable(error):
+    # 429, 5xx, dropped connections and timed out attempts
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code == 429 or code >= 500
+    return isinstance(error, (httpx.TransportError, TimeoutError))
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    # "full jitter": anywhere up to the exponential bound, so clients that
+    # failed together do not retry together
+    return random.uniform(0, min(cap, base * 2 ** attempt))
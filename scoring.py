@@ -0,0 +1,245 @@
+import sys
+import argparse
+
+import numpy as np
+
+from analyze import (
+    DEFAULT_THRESHOLDS,
+    METRIC_NAMES,
+    add_common_arguments,
+    describe_error,
+    find_python_files,
+    iter_function_metrics,
+    map_files,
+    print_failures,
+    run_tolerant,
+    thresholds_from_args,
+)
+
+METRICS = METRIC_NAMES
+
+DEFAULT_WEIGHTS = {
+    "branch_count": 1.0,
+    "depth": 1.0,
+    "lines": 1.0,
+}
+
+# what counts as "one unit" of a metric when it has no threshold of its own
+DEFAULT_SCALES = {
+    "branch_count": 4,
+    "depth": 2,
+    "lines": 50,
+    "cyclomatic": 10,
+    "cognitive": 15,
+    "halstead_volume": 1000,
+    "params": 5,
+}
+
+class MetricsTable:
+    # One array per metric, so filters, scores and top-K selection run over
+    # every function of a run at once instead of one record at a time.
+    def __init__(self, paths, path_ids, qualnames, line, documented, columns):
+        self.paths = paths
+        self.path_ids = path_ids
+        self.qualnames = qualnames
+        self.line = line
+        self.documented = documented
+        self.columns = columns
+
+    @classmethod
+    def from_files(cls, file_columns):
+        paths = []
+        path_ids = []
+        qualnames = []
+        line = []
+        documented = []
+        columns = {name: [] for name in METRICS}
+
+        for path, names, values in file_columns:
+            path_id = len(paths)
+            paths.append(path)
+            path_ids.append(np.full(len(names), path_id, dtype=np.int32))
+            qualnames.extend(names)
+            line.append(values[0])
+            documented.append(values[1])
+            for name, column in zip(METRICS, values[2:]):
+                columns[name].append(column)
+
+        def concat(arrays, dtype=np.int32):
+            if not arrays:
+                return np.zeros(0, dtype=dtype)
+            return np.concatenate(arrays)
+
+        return cls(
+            paths,
+            concat(path_ids),
+            qualnames,
+            concat(line),
+            concat(documented, bool),
+            {name: concat(arrays) for name, arrays in columns.items()},
+        )
+
+    def __len__(self):
+        return len(self.qualnames)
+
+    def flagged_mask(self, thresholds=None, regenerate=False):
+        # the same selection as needs_docstring
+        if thresholds is None:
+            thresholds = DEFAULT_THRESHOLDS
+        mask = np.zeros(len(self), dtype=bool)
+        for name, limit in thresholds.items():
+            mask |= self.columns[name] > limit
+        if not regenerate:
+            mask &= ~self.documented
+        return mask
+
+    def scores(self, weights=None, thresholds=None):
+        # every metric is measured in multiples of its threshold, so the
+        # weights compare like with like
+        weights = weights or DEFAULT_WEIGHTS
+        if thresholds is None:
+            thresholds = DEFAULT_THRESHOLDS
+        total = np.zeros(len(self), dtype=np.float64)
+        for name, weight in weights.items():
+            scale = thresholds.get(name, DEFAULT_SCALES[name])
+            total += weight * self.columns[name] / max(scale, 1)
+        return total
+
+    def top_k(self, n, weights=None, thresholds=None, flagged_only=True,
+              regenerate=False):
+        scores = self.scores(weights, thresholds)
+
+        if flagged_only:
+            candidates = np.flatnonzero(self.flagged_mask(thresholds, regenerate))
+        else:
+            candidates = np.arange(len(self))
+
+        if n < len(candidates):
+            part = np.argpartition(-scores[candidates], n - 1)[:n]
+            candidates = candidates[part]
+
+        order = np.argsort(-scores[candidates], kind="stable")
+        return candidates[order], scores[candidates[order]]
+
+    def row(self, index, score=None):
+        row = {
+            "path": self.paths[self.path_ids[index]],
+            "qualname": self.qualnames[index],
+            "line": int(self.line[index]),
+            "documented": bool(self.documented[index]),
+        }
+        for name in METRICS:
+            row[name] = self.columns[name][index].item()
+        if score is not None:
+            row["score"] = float(score)
+        return row
+
+def columns_of(src):
+    names = []
+    # line, documented, then one list per metric
+    values = [[] for _ in range(len(METRICS) + 2)]
+
+    for metrics in iter_function_metrics(src):
+        names.append(metrics.qualname)
+        values[0].append(metrics.line)
+        values[1].append(metrics.documented)
+        for column, name in zip(values[2:], METRICS):
+            column.append(getattr(metrics, name))
+
+    return names, [
+        np.asarray(values[0], dtype=np.int32),
+        np.asarray(values[1], dtype=bool),
+        *(
+            np.asarray(column, dtype=np.float64 if name == "halstead_volume" else np.int32)
+            for name, column in zip(METRICS, values[2:])
+        ),
+    ]
+
+def file_columns(path):
+    try:
+        (names, values), failure = run_tolerant(path, columns_of)
+    except Exception as e:
+        (names, values) = columns_of("")
+        failure = {"error": describe_error(e), "recovered": False,
+                   "skipped_lines": None}
+    return path, names, values, failure
+
+def collect_table(paths, jobs=None, failures=None):
+    # files that failed are collected into failures when it is given
+    files = find_python_files(paths)
+
+    def columns():
+        for path, names, values, failure in map_files(file_columns, files, jobs):
+            if failure is not None and failures is not None:
+                failures[path] = failure
+            yield path, names, values
+
+    return MetricsTable.from_files(columns())
+
+def worst_functions(paths, n, weights=None, thresholds=None, jobs=None,
+                    flagged_only=True, regenerate=False, failures=None):
+    table = collect_table(paths, jobs, failures)
+    indices, scores = table.top_k(n, weights, thresholds, flagged_only, regenerate)
+    return [table.row(i, score) for i, score in zip(indices, scores)]
+
+def parse_weights(text):
+    weights = {}
+    for item in text.split(","):
+        name, sep, value = item.partition("=")
+        if not sep or name not in METRICS:
+            raise argparse.ArgumentTypeError(
+                f"expected NAME=WEIGHT pairs with NAME in: {', '.join(METRICS)}"
+            )
+        weights[name] = float(value)
+    return weights
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="scoring",
+        description="List the N most complex functions across a code base."
+    )
+    add_common_arguments(parser)
+    parser.add_argument(
+        "-n", "--top", type=int, default=20,
+        help="number of functions to report"
+    )
+    parser.add_argument(
+        "--weights", type=parse_weights, default=DEFAULT_WEIGHTS,
+        help="comma separated NAME=WEIGHT pairs "
+             "(default: branch_count=1,depth=1,lines=1)"
+    )
+    parser.add_argument(
+        "--all", action="store_true",
+        help="also rank functions that are under every threshold"
+    )
+    parser.add_argument(
+        "--regenerate", action="store_true",
+        help="also rank functions whose docstring already covers the signature"
+    )
+    args = parser.parse_args(argv)
+
+    failures = {}
+    rows = worst_functions(
+        args.paths,
+        args.top,
+        weights=args.weights,
+        thresholds=thresholds_from_args(args),
+        jobs=args.jobs,
+        flagged_only=not args.all,
+        regenerate=args.regenerate,
+        failures=failures
+    )
+
+    for row in rows:
+        print(
+            f"{row['score']:7.2f}  {row['path']}:{row['line']}  {row['qualname']}"
+            f"  branches={row['branch_count']} depth={row['depth']} lines={row['lines']}"
+            f" cyclomatic={row['cyclomatic']} cognitive={row['cognitive']}"
+        )
+
+    print_failures(failures)
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,189 @@
+import sys
+import random
+import argparse
+
+INDENT = "    "
+
+class ModuleGenerator:
+    # Builds a syntactically valid module out of a fixed set of statement
+    # shapes. The same options and seed always give the same text.
+    def __init__(self, functions=100, depth=3, class_depth=1, statements=8,
+                 match=True, async_ratio=0.2, class_ratio=0.5, seed=0):
+        self.functions = functions
+        self.depth = depth
+        self.class_depth = class_depth
+        self.statements = statements
+        self.match = match
+        self.async_ratio = async_ratio
+        self.class_ratio = class_ratio
+        self.random = random.Random(seed)
+        self.lines = []
+        self.counter = 0
+
+    def _emit(self, level, text):
+        self.lines.append(INDENT * level + text)
+
+    def _name(self, prefix):
+        self.counter += 1
+        return f"{prefix}_{self.counter}"
+
+    def _expr(self):
+        r = self.random.randrange(5)
+        if r == 0:
+            return "x > limit"
+        if r == 1:
+            return "x % 3 == 0 and not flag"
+        if r == 2:
+            return "len(items) < limit or flag"
+        if r == 3:
+            return "isinstance(x, int)"
+        return "x in seen"
+
+    def _simple(self, level):
+        r = self.random.randrange(4)
+        if r == 0:
+            self._emit(level, "total += x")
+        elif r == 1:
+            self._emit(level, "items.append(x * 2)")
+        elif r == 2:
+            self._emit(level, "seen.add(x)")
+        else:
+            self._emit(level, "x = (x + 1) % (limit or 1)")
+
+    def _block(self, level, depth, async_fn):
+        for _ in range(self.statements):
+            if depth <= 0 or self.random.random() < 0.4:
+                self._simple(level)
+                continue
+
+            kinds = ["if", "for", "while", "try", "with"]
+            if self.match:
+                kinds.append("match")
+            kind = self.random.choice(kinds)
+
+            if kind == "if":
+                self._emit(level, f"if {self._expr()}:")
+                self._nested(level, depth, async_fn)
+                self._emit(level, f"elif {self._expr()}:")
+                self._simple(level + 1)
+                self._emit(level, "else:")
+                self._simple(level + 1)
+            elif kind == "for":
+                loop = "async for" if async_fn else "for"
+                source = "aiter_items(items)" if async_fn else "list(items)"
+                self._emit(level, f"{loop} x in {source}:")
+                self._nested(level, depth, async_fn)
+            elif kind == "while":
+                self._emit(level, f"while {self._expr()}:")
+                self._nested(level, depth, async_fn)
+                self._emit(level + 1, "break")
+            elif kind == "try":
+                self._emit(level, "try:")
+                self._nested(level, depth, async_fn)
+                self._emit(level, "except (ValueError, KeyError):")
+                self._emit(level + 1, "total -= 1")
+            elif kind == "with":
+                self._emit(level, "with lock:")
+                self._nested(level, depth, async_fn)
+            else:
+                self._emit(level, "match x:")
+                self._emit(level + 1, "case 0:")
+                self._nested(level + 1, depth, async_fn)
+                self._emit(level + 1, "case [first, *rest]:")
+                self._emit(level + 2, "items.extend(rest)")
+                self._emit(level + 1, "case _:")
+                self._simple(level + 2)
+
+    def _nested(self, level, depth, async_fn):
+        saved = self.statements
+        self.statements = max(1, self.statements // 2)
+        self._block(level + 1, depth - 1, async_fn)
+        self.statements = saved
+
+    def _function(self, level, method=False):
+        async_fn = self.random.random() < self.async_ratio
+        prefix = "async def" if async_fn else "def"
+        name = self._name("method" if method else "func")
+        params = "self, items, limit=10, flag=False" if method else "items, limit=10, flag=False"
+
+        self._emit(level, f"{prefix} {name}({params}):")
+        if self.random.random() < 0.3:
+            self._emit(level + 1, f'"""Process items for {name}."""')
+        self._emit(level + 1, "total = 0")
+        self._emit(level + 1, "seen = set()")
+        self._emit(level + 1, "x = 0")
+        self._block(level + 1, self.random.randint(0, self.depth), async_fn)
+        self._emit(level + 1, "return total")
+        self._emit(0, "")
+
+    def _class(self, level, remaining, class_depth):
+        self._emit(level, f"class {self._name('Class')}:")
+        self._emit(level + 1, "lock = None")
+        self._emit(0, "")
+
+        methods = min(remaining, self.random.randint(1, 5))
+        for _ in range(methods):
+            self._function(level + 1, method=True)
+
+        made = methods
+        if class_depth > 1 and remaining - made > 0:
+            made += self._class(level + 1, remaining - made, class_depth - 1)
+        return made
+
+    def generate(self):
+        self.lines = [
+            "# generated by synth.py",
+            "lock = None",
+            "",
+            "async def aiter_items(items):",
+            f"{INDENT}for item in items:",
+            f"{INDENT * 2}yield item",
+            "",
+        ]
+
+        made = 0
+        while made < self.functions:
+            if self.class_depth > 0 and self.random.random() < self.class_ratio:
+                made += self._class(0, self.functions - made, self.class_depth)
+            else:
+                self._function(0)
+                made += 1
+
+        return "\n".join(self.lines) + "\n"
+
+def generate_module(functions=100, **options):
+    return ModuleGenerator(functions, **options).generate()
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="synth",
+        description="Generate a deterministic Python module for stress tests."
+    )
+    parser.add_argument("-n", "--functions", type=int, default=100)
+    parser.add_argument("--depth", type=int, default=3, help="maximum block nesting")
+    parser.add_argument("--class-depth", type=int, default=1, help="maximum class nesting")
+    parser.add_argument("--statements", type=int, default=8, help="statements per block")
+    parser.add_argument("--no-match", action="store_true", help="leave out match statements")
+    parser.add_argument("--async-ratio", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="write here instead of stdout")
+    args = parser.parse_args(argv)
+
+    src = generate_module(
+        args.functions,
+        depth=args.depth,
+        class_depth=args.class_depth,
+        statements=args.statements,
+        match=not args.no_match,
+        async_ratio=args.async_ratio,
+        seed=args.seed
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(src)
+    else:
+        sys.stdout.write(src)
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,70 @@
+import os
+import time
+import json
+import cProfile
+from contextlib import contextmanager, nullcontext
+
+class PhaseTimer:
+    # Accumulates wall time and call counts per named phase. An optional
+    # callback gets (phase, seconds) every time a phase ends.
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.seconds = {}
+        self.calls = {}
+        self.counters = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self.callback is not None:
+                self.callback(name, elapsed)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, totals):
+        for name, seconds in totals["seconds"].items():
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        for name, calls in totals["calls"].items():
+            self.calls[name] = self.calls.get(name, 0) + calls
+        for name, n in totals["counters"].items():
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self):
+        return {
+            "seconds": dict(self.seconds),
+            "calls": dict(self.calls),
+            "counters": dict(self.counters),
+        }
+
+class NullTimer:
+    # what everything uses unless instrumentation is asked for
+    _null = nullcontext()
+
+    def phase(self, name):
+        return self._null
+
+    def count(self, name, n=1):
+        pass
+
+NULL_TIMER = NullTimer()
+
+def profile_call(profile_dir, name, func, *args, **kwargs):
+    # runs func under cProfile and dumps pstats data to profile_dir/<name>.prof
+    os.makedirs(profile_dir, exist_ok=True)
+    safe = os.path.normpath(name).replace(os.sep, "__").replace(":", "_").lstrip("._")
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(os.path.join(profile_dir, f"{safe}.prof"))
+
+def write_timings(path, totals, files):
+    with open(path, "w") as f:
+        json.dump({"totals": totals, "files": files}, f, indent=2)
@@ -0,0 +1,190 @@
+import os
+import time
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_DELETE_SELF
+)
+
+EVENT_HEADER = struct.Struct("iIII")
+
+def skip_dir(name):
+    return name.startswith(".") or name == "__pycache__"
+
+class PollingWatcher:
+    # Compares (mtime, size) of every listed file between polls. Only stat()
+    # is called, so unchanged files are never read.
+    def __init__(self, list_files, interval=1.0, debounce=0.2):
+        self.list_files = list_files
+        self.interval = interval
+        self.debounce = debounce
+        self.state = self._snapshot()
+
+    def _snapshot(self):
+        state = {}
+        for path in self.list_files():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            state[path] = (st.st_mtime_ns, st.st_size)
+        return state
+
+    def _diff(self, new):
+        changed = {p for p, sig in new.items() if self.state.get(p) != sig}
+        removed = set(self.state) - set(new)
+        return changed, removed
+
+    def batches(self):
+        while True:
+            time.sleep(self.interval)
+            new = self._snapshot()
+            changed, removed = self._diff(new)
+            if not changed and not removed:
+                continue
+
+            # wait until the files stop moving, e.g. an editor writing in steps
+            while True:
+                time.sleep(self.debounce)
+                settled = self._snapshot()
+                if settled == new:
+                    break
+                new = settled
+
+            changed, removed = self._diff(new)
+            self.state = new
+            if changed or removed:
+                yield changed, removed
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    # Linux only: one inotify watch per directory under the roots, so the
+    # cost does not grow with the number of files.
+    def __init__(self, roots, wanted, debounce=0.2):
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError(errno.ENOSYS, "libc not found")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.wanted = wanted
+        self.debounce = debounce
+        self.dirs = {}
+
+        try:
+            for root in roots:
+                self._add_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed: {path}")
+        self.dirs[wd] = path
+
+    def _add_tree(self, root):
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not skip_dir(d)]
+            self._add_watch(dirpath)
+
+    def _read_events(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def _handle(self, events, touched):
+        for wd, mask, name in events:
+            directory = self.dirs.get(wd)
+            if directory is None:
+                continue
+
+            if mask & IN_DELETE_SELF:
+                del self.dirs[wd]
+                continue
+
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and not skip_dir(name):
+                    self._add_tree(path)
+                    # files may have landed before the watch existed
+                    for dirpath, dirnames, filenames in os.walk(path):
+                        dirnames[:] = [d for d in dirnames if not skip_dir(d)]
+                        touched.update(
+                            os.path.join(dirpath, f) for f in filenames
+                            if self.wanted(os.path.join(dirpath, f))
+                        )
+                continue
+
+            if self.wanted(path):
+                touched.add(path)
+
+    def batches(self):
+        while True:
+            touched = set()
+            self._handle(self._read_events(None), touched)
+
+            # keep collecting until the directory has been quiet for a while
+            while True:
+                events = self._read_events(self.debounce)
+                if not events:
+                    break
+                self._handle(events, touched)
+
+            changed = {p for p in touched if os.path.exists(p)}
+            removed = touched - changed
+            if changed or removed:
+                yield changed, removed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+def make_watcher(paths, list_files, interval=1.0, debounce=0.2, use_inotify=True):
+    # inotify when every path is a directory and the platform has it,
+    # polling otherwise
+    if use_inotify and paths and all(os.path.isdir(p) for p in paths):
+        try:
+            return InotifyWatcher(paths, lambda p: p.endswith(".py"), debounce)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(list_files, interval, debounce)